@@ -0,0 +1,312 @@
+# broadcast.py
+import asyncio
+import json
+import logging
+import os
+from collections import deque
+
+from pyrogram.errors import FloodWait, InternalServerError
+
+from config import DB_NAME, BROADCAST_PAGE_SIZE, BROADCAST_WORKERS
+from database import db, adb
+from executor import iterate_blocking, run_blocking
+from rate_limiter import AdaptiveRateLimiter
+
+logger = logging.getLogger(__name__)
+
+def get_progress_bar(current, total):
+    if total == 0: return "[░░░░░░░░░░] 0%"
+    percentage = min(current / total, 1) * 100
+    filled = int(percentage / 10)
+    bar = "█" * filled + "░" * (10 - filled)
+    return f"[{bar}] {percentage:.1f}%"
+
+# Errors meaning the target will never accept messages from the bot again
+DEAD_ERRORS = (
+    "PEER_ID_INVALID", "USER_IS_BLOCKED", "USER_DEACTIVATED", "INPUT_USER_DEACTIVATED",
+    "CHAT_WRITE_FORBIDDEN", "CHANNEL_PRIVATE", "CHANNEL_INVALID", "CHAT_ID_INVALID"
+)
+
+def describe_error(e):
+    err_name = type(e).__name__
+    if "PEER_ID_INVALID" in str(e) or "USER_IS_BLOCKED" in str(e): err_name = "Bot Blocked"
+    elif "USER_DEACTIVATED" in str(e): err_name = "Deleted Account"
+    elif "CHAT_WRITE_FORBIDDEN" in str(e) or "CHANNEL_PRIVATE" in str(e): err_name = "Removed From Chat"
+    return err_name
+
+# Errors that say nothing about the target: our own rate limit, Telegram or network trouble
+TRANSIENT_ERRORS = (FloodWait, InternalServerError, OSError, asyncio.TimeoutError)
+
+def is_dead_error(e):
+    return any(marker in str(e) for marker in DEAD_ERRORS)
+
+class BroadcastJob:
+    """A broadcast in progress, mirrored in the broadcast_jobs table."""
+
+    def __init__(self, row):
+        self.id = row['id']
+        self.admin_id = row['admin_id']
+        self.messages = json.loads(row['messages']) # [[from_chat_id, message_id], ...]
+        self.phase = row['phase'] or 'users'
+        self.last_target = row['last_target']
+        self.total = row['total'] or 0
+        self.success = row['success'] or 0
+        self.failed = row['failed'] or 0
+        self.errors = json.loads(row['errors']) if row['errors'] else {}
+        self.status_chat_id = row['status_chat_id']
+        self.status_message_id = row['status_message_id']
+        # What save() stores: counts up to last_target only. The live counters above also
+        # include pages still in flight, whose deliveries are re-read on resume.
+        self.saved_success = self.success
+        self.saved_failed = self.failed
+        self.saved_errors = dict(self.errors)
+
+    def commit_page(self, page):
+        self.saved_success += page['success']
+        self.saved_failed += page['failed']
+        for err_name, count in page['errors'].items():
+            self.saved_errors[err_name] = self.saved_errors.get(err_name, 0) + count
+
+    async def save(self, status='running'):
+        await adb.update_broadcast_job(
+            self.id, self.phase, self.last_target, self.saved_success, self.saved_failed, json.dumps(self.saved_errors), status
+        )
+
+class BroadcastEngine:
+    """Runs broadcasts as durable jobs that resume after a restart.
+
+    Targets are streamed from the users table and then the chats table in pages of
+    BROADCAST_PAGE_SIZE ids into a bounded queue drained by BROADCAST_WORKERS workers.
+    Once a page is fully sent the job's position is saved; until then every delivery
+    is recorded, so a resumed job skips targets that were already sent to instead of
+    double-sending. Each finished page also records which targets are dead, so later
+    broadcasts skip them.
+    """
+
+    def __init__(self):
+        self.tasks = {} # {job_id: asyncio.Task}
+        # Shared by all jobs: Telegram's flood limits are per bot, not per broadcast
+        self.limiter = AdaptiveRateLimiter()
+
+    async def start(self, client, admin_id, messages, status_msg):
+        """Creates a job for `messages` (Message objects) and starts sending in the background."""
+        total = await adb.get_broadcast_target_count()
+        payload = json.dumps([[m.chat.id, m.id] for m in messages])
+        job_id = await adb.create_broadcast_job(admin_id, payload, total, status_msg.chat.id, status_msg.id)
+        if job_id is None:
+            raise Exception("Could not save the broadcast job")
+
+        row = next(j for j in await adb.get_broadcast_jobs() if j['id'] == job_id)
+        self._launch(client, BroadcastJob(row))
+        return job_id
+
+    async def resume_all(self, client):
+        """Restarts every job that was still running when the bot stopped."""
+        for row in await adb.get_broadcast_jobs():
+            if row['id'] in self.tasks:
+                continue
+            job = BroadcastJob(row)
+            # Deliveries past the saved position were not yet counted in the job row
+            for status in (await adb.get_broadcast_deliveries(job.id)).values():
+                if status == 'sent':
+                    job.success += 1
+                else:
+                    job.failed += 1
+            logger.info(f"Resuming broadcast job {job.id} at {job.phase} > {job.last_target}")
+            self._launch(client, job)
+
+    def _launch(self, client, job):
+        task = asyncio.create_task(self._run(client, job))
+        self.tasks[job.id] = task
+        task.add_done_callback(lambda _: self.tasks.pop(job.id, None))
+
+    async def _run(self, client, job):
+        # Bounded queue: the producer only stays a couple of batches ahead of the workers,
+        # so memory is flat whatever the audience size
+        queue = asyncio.Queue(maxsize=BROADCAST_WORKERS * 2)
+        # Pages in target order, each {'phase', 'last', 'ids', 'remaining', 'outcomes', 'success', 'failed', 'errors'}
+        pages = deque()
+        checkpoint_lock = asyncio.Lock()
+
+        async def checkpoint():
+            # The saved position may only move past pages that are completely sent
+            async with checkpoint_lock:
+                done = []
+                while pages and pages[0]['remaining'] == 0:
+                    page = pages.popleft()
+                    job.phase, job.last_target = page['phase'], page['last']
+                    job.commit_page(page)
+                    done.append(page)
+                if done:
+                    await job.save()
+                    for page in done:
+                        await adb.record_target_outcomes(page['phase'], page['outcomes'])
+                        await adb.clear_broadcast_deliveries(job.id, page['ids'])
+
+        async def produce():
+            delivered = await adb.get_broadcast_deliveries(job.id)
+            phases = [('users', job.last_target), ('chats', None)] if job.phase == 'users' else [('chats', job.last_target)]
+            for phase, after in phases:
+                # One streaming cursor per phase instead of a query per page
+                stream = db.iter_broadcast_targets(phase, after, BROADCAST_PAGE_SIZE)
+                try:
+                    async for ids in iterate_blocking(stream):
+                        await enqueue(phase, ids, delivered)
+                finally:
+                    await run_blocking(stream.close)
+
+            for _ in range(BROADCAST_WORKERS):
+                await queue.put(None)
+
+        async def enqueue(phase, ids, delivered):
+            todo = [target for target in ids if target not in delivered]
+            page = {
+                'phase': phase, 'last': ids[-1], 'ids': ids, 'remaining': len(todo), 'outcomes': {},
+                'success': 0, 'failed': 0, 'errors': {}
+            }
+            # Sent before a restart: already in the live counters via resume_all
+            for target in ids:
+                if target in delivered:
+                    page['success' if delivered[target] == 'sent' else 'failed'] += 1
+            pages.append(page)
+            if not todo:
+                await checkpoint()
+            for target in todo:
+                await queue.put((page, target))
+
+        async def work():
+            while True:
+                item = await queue.get()
+                if item is None:
+                    return
+                page, target = item
+                status, err_name = await self._send_to_target(client, job, target)
+                page['outcomes'][target] = status
+                if status == 'sent':
+                    page['success'] += 1
+                else:
+                    page['failed'] += 1
+                    page['errors'][err_name] = page['errors'].get(err_name, 0) + 1
+                page['remaining'] -= 1
+                if page['remaining'] == 0:
+                    await checkpoint()
+
+        async def report():
+            while True:
+                await asyncio.sleep(5)
+                await self._report(client, job)
+
+        producer = asyncio.create_task(produce())
+        workers = [asyncio.create_task(work()) for _ in range(BROADCAST_WORKERS)]
+        reporter = asyncio.create_task(report())
+        try:
+            await asyncio.wait([producer, *workers], return_when=asyncio.FIRST_EXCEPTION)
+            errors = [t.exception() for t in (producer, *workers) if t.done() and not t.cancelled() and t.exception()]
+            if errors:
+                # Stop feeding and let each worker finish the target in hand, so nothing is sent
+                # unrecorded; queued targets are picked up again on resume
+                producer.cancel()
+                while not queue.empty():
+                    queue.get_nowait()
+                for _ in workers:
+                    queue.put_nowait(None)
+                await asyncio.gather(*workers, return_exceptions=True)
+                raise errors[0]
+
+            await job.save(status='done')
+            await adb.clear_broadcast_deliveries(job.id)
+            await self._report(client, job, final=True)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Left as 'running' so it resumes on the next start
+            logger.error(f"Broadcast job {job.id} stopped: {e}")
+        finally:
+            reporter.cancel()
+            producer.cancel()
+            for worker in workers:
+                worker.cancel()
+
+    async def _send_to_target(self, client, job, target_id):
+        """Sends the job's messages to one target. Returns ('sent' | 'dead' | 'failed' | 'skipped', error name).
+
+        'skipped' is a transient failure, which is not held against the target.
+        """
+        err_name = None
+        try:
+            for from_chat_id, message_id in job.messages:
+                await self._copy(client, target_id, from_chat_id, message_id)
+            job.success += 1
+            status = 'sent'
+        except Exception as e:
+            err_name = describe_error(e)
+            job.errors[err_name] = job.errors.get(err_name, 0) + 1
+            logger.error(f"Broadcast error for {target_id}: {e}")
+            job.failed += 1
+            if is_dead_error(e):
+                status = 'dead'
+            elif isinstance(e, TRANSIENT_ERRORS):
+                status = 'skipped'
+            else:
+                status = 'failed'
+        finally:
+            self.limiter.release(target_id)
+        await adb.record_broadcast_delivery(job.id, target_id, status)
+        return status, err_name
+
+    async def _copy(self, client, target_id, from_chat_id, message_id, attempts=3):
+        for attempt in range(attempts):
+            await self.limiter.acquire(target_id)
+            try:
+                await client.copy_message(target_id, from_chat_id, message_id)
+                self.limiter.on_success()
+                return
+            except FloodWait as e:
+                # Every sender backs off, not just this one
+                self.limiter.on_flood_wait(e.value)
+                if attempt == attempts - 1:
+                    raise
+
+    async def _report(self, client, job, final=False):
+        # Database source detection
+        db_type = "PostgreSQL" if db.is_postgres else "SQLite"
+        if not db.is_postgres:
+            db_type += f" ({os.path.abspath(DB_NAME)})"
+
+        if final:
+            # Format error report
+            err_report = ""
+            if job.errors:
+                err_report = "\n\n⚠️ **Failure Reasons:**\n"
+                for err, count in job.errors.items():
+                    err_report += f"• `{err}`: {count}\n"
+
+            text = (
+                f"✅ **Broadcast Completed!**\n\n"
+                f"✨ **Successful:** `{job.success}`\n"
+                f"❌ **Failed:** `{job.failed}`\n"
+                f"👥 **Total Targets:** `{job.total}`\n"
+                f"📂 **Database Source:** `{db_type}`"
+                f"{err_report}\n"
+                "Broadcast mode deactivated and queue cleared."
+            )
+        else:
+            progress = get_progress_bar(job.success + job.failed, job.total)
+            text = (
+                f"🚀 **Powerful Broadcast in Progress...**\n\n"
+                f"📊 **Progress:** {progress}\n"
+                f"✨ **Successful:** `{job.success}`\n"
+                f"❌ **Failed:** `{job.failed}`\n"
+                f"🎯 **Total Targets:** `{job.total}`\n"
+                f"📂 **DB:** `{db_type}`"
+            )
+
+        try:
+            await client.edit_message_text(job.status_chat_id, job.status_message_id, text)
+        except Exception as e:
+            if "MESSAGE_NOT_MODIFIED" not in str(e):
+                logger.error(f"Broadcast status update error: {e}")
+                if final:
+                    await client.send_message(job.admin_id, text)
+
+broadcaster = BroadcastEngine()
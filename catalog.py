@@ -0,0 +1,294 @@
+# catalog.py
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from config import FOLDER_ID, SEARCH_CACHE_SIZE, SEARCH_CACHE_TTL
+from database import db
+from executor import AsyncProxy
+from gdrive_handler import drive_handler, FOLDER_MIME
+from search_engine import SearchEngine
+
+logger = logging.getLogger(__name__)
+
+def normalize_query(query):
+    return " ".join(query.lower().split())
+
+class QueryCache:
+    """LRU cache of search results whose entries expire after `ttl` seconds."""
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict() # {(query, limit): (expires_at, results)}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry[0] > time.monotonic():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry:
+                del self.entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+class FileCatalog:
+    """Local index of the Drive folder tree, kept in memory and mirrored in the files table.
+
+    Searches are answered from memory by a ranked, typo-tolerant SearchEngine so they
+    never hit the Drive API. The index covers FOLDER_ID and every folder below it, whose
+    ids are kept in self.folders (and the drive_folders table). It is loaded from the
+    database at startup and kept fresh by sync(), which applies the Drive change feed
+    since the page token stored in settings instead of re-listing the folder.
+    """
+
+    def __init__(self):
+        self.files = {} # {drive_id: file dict, shaped like Drive API results}
+        self.folders = {} # {folder_id: parent_id} for folders below FOLDER_ID
+        self.engine = SearchEngine()
+        self.lock = threading.Lock()
+        # One sync/rebuild at a time (the sync loop and /scan may both ask for one)
+        self.sync_lock = threading.RLock()
+        self.loaded = False
+        # Cleared whenever the index changes, so cached results are never stale
+        self.cache = QueryCache(SEARCH_CACHE_SIZE, SEARCH_CACHE_TTL)
+
+    def load(self):
+        """Loads the index persisted in the database."""
+        files = db.get_drive_files()
+        folders = db.get_drive_folders()
+        with self.lock:
+            self.folders = folders
+            self.files = {}
+            self.engine = SearchEngine()
+            for f in files:
+                self._put(f)
+            self.loaded = True
+        self.cache.clear()
+        logger.info(f"Catalog loaded {len(files)} files from database.")
+
+    def _put(self, f):
+        self.files[f['id']] = f
+        self.engine.add(f['id'], f.get('name') or '')
+
+    def get(self, file_id):
+        return self.files.get(file_id)
+
+    def count(self):
+        """Number of indexed files, kept in memory so /stats never walks Drive."""
+        return len(self.files)
+
+    def all_files(self):
+        with self.lock:
+            return list(self.files.values())
+
+    def add(self, files):
+        if not files:
+            return
+        db.upsert_drive_files(files)
+        with self.lock:
+            for f in files:
+                self._put(f)
+        self.cache.clear()
+
+    def remove(self, file_ids):
+        file_ids = [fid for fid in file_ids if fid in self.files]
+        if not file_ids:
+            return
+        db.delete_drive_files(file_ids)
+        with self.lock:
+            for fid in file_ids:
+                self.files.pop(fid, None)
+                self.engine.remove(fid)
+        self.cache.clear()
+
+    def replace_all(self, files):
+        """Replaces the whole index with a complete folder listing."""
+        seen = {f['id'] for f in files}
+        self.add(files)
+        self.remove([fid for fid in list(self.files) if fid not in seen])
+
+    def replace_folders(self, folders):
+        """Replaces the folder set with a complete listing, {folder_id: Drive folder dict}."""
+        db.upsert_drive_folders(list(folders.values()))
+        db.delete_drive_folders([fid for fid in self.folders if fid not in folders])
+        with self.lock:
+            self.folders = {fid: (f.get('parents') or [None])[0] for fid, f in folders.items()}
+
+    def rebuild(self):
+        """Full rescan of the Drive folder tree."""
+        with self.sync_lock:
+            return self._rebuild()
+
+    def _rebuild(self):
+        folders = {}
+        files = drive_handler.get_all_files(folders)
+        if not files:
+            # An empty listing is more likely an API error than an empty folder
+            logger.warning("Catalog rebuild skipped: Drive returned no files.")
+            return 0
+        self.replace_folders(folders)
+        self.replace_all(files)
+        logger.info(f"Catalog rebuilt with {len(files)} files in {len(folders) + 1} folders.")
+        return len(files)
+
+    def sync(self):
+        """Brings the index up to date. Returns the number of files added, updated or removed.
+
+        A caller arriving while another sync runs waits for it, then syncs again (cheaply).
+        """
+        with self.sync_lock:
+            return self._sync()
+
+    def _sync(self):
+        if not self.loaded:
+            self.load()
+
+        token = db.get_setting("drive_changes_token")
+        # Indexes built before subfolders were covered need one full crawl
+        if not token or not self.files or db.get_setting("catalog_tree") != "1":
+            # Take the token before listing so changes made during the rebuild are replayed
+            token = drive_handler.get_start_page_token()
+            count = self._rebuild()
+            if token and count:
+                db.set_setting("drive_changes_token", token)
+                db.set_setting("catalog_tree", "1")
+            return count
+
+        changes, next_token = drive_handler.get_changes(token)
+        count = self.apply_changes(changes)
+        if next_token and next_token != token:
+            db.set_setting("drive_changes_token", next_token)
+        if count:
+            logger.info(f"Catalog applied {count} Drive changes.")
+        return count
+
+    def apply_changes(self, changes):
+        """Applies Drive change records (adds, renames, moves, trashes, deletions)."""
+        upserts = {}
+        removals = set()
+        # Folder changes first, so files are judged against the updated folder set
+        changes = sorted(changes, key=lambda c: not self._is_folder_change(c))
+        for change in changes:
+            f = change.get('file') or {}
+            file_id = change.get('fileId') or f.get('id')
+            if not file_id:
+                continue
+            if self._is_folder_change(change):
+                self._apply_folder_change(change, f, file_id, upserts, removals)
+                continue
+            if change.get('removed') or not f or self._is_outside(f):
+                removals.add(file_id)
+                upserts.pop(file_id, None)
+            else:
+                f = {k: v for k, v in f.items() if k != 'trashed'}
+                upserts[file_id] = f
+                removals.discard(file_id)
+
+        self.add(list(upserts.values()))
+        self.remove(list(removals))
+        return len(upserts) + len(removals)
+
+    def _is_folder_change(self, change):
+        f = change.get('file') or {}
+        return f.get('mimeType') == FOLDER_MIME or (change.get('fileId') or f.get('id')) in self.folders
+
+    def _apply_folder_change(self, change, f, folder_id, upserts, removals):
+        """Tracks a folder created, moved or deleted inside the tree. Files moved along with a
+        folder get no change records of their own, so they are listed or dropped here."""
+        if not FOLDER_ID:
+            return
+        parents = f.get('parents') or []
+        inside = not change.get('removed') and f and not f.get('trashed') and any(self._in_tree(p) for p in parents)
+        if inside:
+            if folder_id in self.folders:
+                # Renamed or moved within the tree
+                with self.lock:
+                    self.folders[folder_id] = parents[0]
+                db.upsert_drive_folders([f])
+                return
+            # New here: pick up whatever it already contains
+            folders = {folder_id: f}
+            try:
+                for _, children in drive_handler.walk_tree(folder_id):
+                    for child in children:
+                        if child.get('mimeType') == FOLDER_MIME:
+                            folders[child['id']] = child
+                        else:
+                            upserts[child['id']] = child
+                            removals.discard(child['id'])
+            except Exception as e:
+                logger.error(f"Catalog could not list new folder {folder_id}: {e}")
+            db.upsert_drive_folders(list(folders.values()))
+            with self.lock:
+                self.folders.update({fid: (d.get('parents') or [None])[0] for fid, d in folders.items()})
+        elif folder_id in self.folders:
+            # Left the tree: drop it, its subfolders and their files
+            gone = {folder_id}
+            children = {}
+            for fid, parent in self.folders.items():
+                children.setdefault(parent, []).append(fid)
+            stack = [folder_id]
+            while stack:
+                for child in children.get(stack.pop(), ()):
+                    if child not in gone:
+                        gone.add(child)
+                        stack.append(child)
+            with self.lock:
+                for fid in gone:
+                    self.folders.pop(fid, None)
+            db.delete_drive_folders(list(gone))
+            with self.lock:
+                inside_gone = [fid for fid, file in self.files.items() if any(p in gone for p in file.get('parents') or [])]
+            for fid in inside_gone:
+                removals.add(fid)
+                upserts.pop(fid, None)
+
+    def _in_tree(self, folder_id):
+        return folder_id == FOLDER_ID or folder_id in self.folders
+
+    def _is_outside(self, f):
+        if f.get('trashed') or f.get('mimeType') == FOLDER_MIME:
+            return True
+        return bool(FOLDER_ID) and not any(self._in_tree(p) for p in f.get('parents') or [])
+
+    def search(self, query, limit=100):
+        """Returns the files best matching the query, best first."""
+        text = normalize_query(query)
+        if not text:
+            return []
+
+        key = (text, limit)
+        results = self.cache.get(key)
+        if results is None:
+            results = self._search(text, limit)
+            self.cache.put(key, results)
+        return results
+
+    def _search(self, query, limit):
+        if not self.files:
+            # Index not built yet, ask Drive directly
+            return drive_handler.search_files(query)[:limit]
+
+        with self.lock:
+            return [self.files[fid] for fid in self.engine.search(query, limit)]
+
+catalog = FileCatalog()
+acatalog = AsyncProxy(catalog)
@@ -24,3 +24,63 @@ REQUEST_GROUP = os.environ.get("REQUEST_GROUP", "requestmpm")
 # Bot administrators (User IDs, comma-separated in env)
 ADMIN_IDS_STR = os.environ.get("ADMIN_IDS", "6115934442")
 ADMIN_IDS = [int(i.strip()) for i in ADMIN_IDS_STR.split(",") if i.strip()]
+
+# How often (seconds) the local file index is synced with Google Drive
+INDEX_SYNC_INTERVAL = int(os.environ.get("INDEX_SYNC_INTERVAL", 60))
+
+# Size of the thread pool running blocking Drive and database calls
+WORKER_THREADS = int(os.environ.get("WORKER_THREADS", 8))
+
+# Downloads up to this size (bytes) are buffered in memory; larger ones spill to a temp file
+STREAM_MEMORY_LIMIT = int(os.environ.get("STREAM_MEMORY_LIMIT", 20 * 1024 * 1024))
+
+# PostgreSQL connection pool bounds, and idle seconds after which a pooled connection is pinged before reuse
+DB_POOL_MIN = int(os.environ.get("DB_POOL_MIN", 1))
+DB_POOL_MAX = int(os.environ.get("DB_POOL_MAX", WORKER_THREADS + 2))
+DB_HEALTH_CHECK_IDLE = int(os.environ.get("DB_HEALTH_CHECK_IDLE", 60))
+
+# User activity (add_user) is buffered and written in batches of this size, or every interval seconds
+USER_FLUSH_SIZE = int(os.environ.get("USER_FLUSH_SIZE", 500))
+USER_FLUSH_INTERVAL = int(os.environ.get("USER_FLUSH_INTERVAL", 5))
+
+# Seconds between checks of the shared ban list version (for multi-worker deployments)
+BAN_CACHE_TTL = int(os.environ.get("BAN_CACHE_TTL", 30))
+
+# Seconds between flushes of the in-memory search counters
+SEARCH_FLUSH_INTERVAL = int(os.environ.get("SEARCH_FLUSH_INTERVAL", 30))
+
+# Search result cache: max distinct queries kept and seconds before an entry expires
+SEARCH_CACHE_SIZE = int(os.environ.get("SEARCH_CACHE_SIZE", 1000))
+SEARCH_CACHE_TTL = int(os.environ.get("SEARCH_CACHE_TTL", 300))
+
+# Seconds Telegram may cache inline query results
+INLINE_CACHE_TIME = int(os.environ.get("INLINE_CACHE_TIME", 300))
+
+# Group auto-search: seconds to wait for a user's burst of messages to settle,
+# and max searches answered per group per minute
+GROUP_SEARCH_DEBOUNCE = float(os.environ.get("GROUP_SEARCH_DEBOUNCE", 1.5))
+GROUP_SEARCH_BUDGET = int(os.environ.get("GROUP_SEARCH_BUDGET", 10))
+
+# Broadcast targets are loaded and checkpointed in pages of this many ids
+BROADCAST_PAGE_SIZE = int(os.environ.get("BROADCAST_PAGE_SIZE", 500))
+
+# Broadcast send rate (messages/second): starts at the initial rate and adapts up to the max
+BROADCAST_MAX_RATE = float(os.environ.get("BROADCAST_MAX_RATE", 28))
+BROADCAST_INITIAL_RATE = float(os.environ.get("BROADCAST_INITIAL_RATE", 10))
+# Concurrent senders per broadcast job
+BROADCAST_WORKERS = int(os.environ.get("BROADCAST_WORKERS", 30))
+# Consecutive transient broadcast failures after which a user/chat is skipped
+BROADCAST_MAX_FAILURES = int(os.environ.get("BROADCAST_MAX_FAILURES", 3))
+# Rows fetched per round trip when streaming large tables
+STREAM_BATCH_SIZE = int(os.environ.get("STREAM_BATCH_SIZE", 1000))
+# Drive batch requests: calls per batch (Drive allows 100), batches in flight, retry rounds
+DRIVE_BATCH_SIZE = int(os.environ.get("DRIVE_BATCH_SIZE", 100))
+DRIVE_BATCH_CONCURRENCY = int(os.environ.get("DRIVE_BATCH_CONCURRENCY", 4))
+DRIVE_BATCH_RETRIES = int(os.environ.get("DRIVE_BATCH_RETRIES", 5))
+# Drive folders listed in parallel when walking the folder tree
+DRIVE_CRAWL_CONCURRENCY = int(os.environ.get("DRIVE_CRAWL_CONCURRENCY", 8))
+# Google Drive auth: seconds an "unauthorized" result is trusted before the token is
+# looked up again, and how long before expiry the access token is refreshed in the background
+AUTH_NEGATIVE_TTL = int(os.environ.get("AUTH_NEGATIVE_TTL", 60))
+AUTH_REFRESH_MARGIN = int(os.environ.get("AUTH_REFRESH_MARGIN", 300))
+AUTH_REFRESH_INTERVAL = int(os.environ.get("AUTH_REFRESH_INTERVAL", 60))
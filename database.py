@@ -2,9 +2,23 @@
 import sqlite3
 import os
 import logging
+import threading
+import itertools
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime, timedelta
 import psycopg2
+from psycopg2.extras import execute_batch
+from psycopg2.pool import ThreadedConnectionPool
 from urllib.parse import urlparse
-from config import DB_NAME
+from config import DB_NAME, DB_POOL_MIN, DB_POOL_MAX, DB_HEALTH_CHECK_IDLE, USER_FLUSH_SIZE, BROADCAST_MAX_FAILURES, STREAM_BATCH_SIZE
+from executor import AsyncProxy, pool
+
+# WHERE clause for users/chats a broadcast can reach (takes BROADCAST_MAX_FAILURES)
+REACHABLE = "blocked_at IS NULL AND COALESCE(fail_count, 0) < ?"
+# Names for server-side cursors, unique per connection
+cursor_names = itertools.count()
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -13,36 +27,102 @@ logger = logging.getLogger(__name__)
 class Database:
     def __init__(self):
         self.database_url = os.environ.get('DATABASE_URL')
-        self.conn = None
+        self.pool = None
         self.is_postgres = bool(self.database_url)
         self.placeholder = "%s" if self.is_postgres else "?"
+        # Write-behind buffer for add_user: {user_id: (name, username, last_seen, private)}
+        self.pending_users = {}
+        self.pending_lock = threading.Lock()
+        # Whether files.file_name has a text index (FTS5 on SQLite, pg_trgm on Postgres)
+        self.text_index = False
+        # Searches not yet written: {(day, term): count}
+        self.pending_searches = Counter()
+        # Banned user ids, reloaded when the 'ban_version' setting changes
+        self.banned_users = set()
+        self.ban_version = None
         self.connect()
         self.create_tables()
+        self.load_bans()
 
     def connect(self):
+        """Sets up the connection pool (Postgres) or per-thread connections (SQLite)."""
         try:
             if self.is_postgres:
-                self.conn = psycopg2.connect(self.database_url, sslmode='require')
-                self.conn.autocommit = True
+                self.pool = ThreadedConnectionPool(DB_POOL_MIN, DB_POOL_MAX, self.database_url, sslmode='require')
+                # getconn() raises when the pool is exhausted; make callers wait for a free connection instead
+                self.pool_slots = threading.BoundedSemaphore(DB_POOL_MAX)
+                self.last_used = {} # {id(conn): time of last checkin}
             else:
-                self.conn = sqlite3.connect(DB_NAME, check_same_thread=False)
+                self.local = threading.local()
         except Exception as e:
             logger.error(f"Database connection error: {e}")
             raise e
 
-    def get_cursor(self):
-        # Reconnect if connection is closed (esp for Postgres)
+    def _sqlite_connection(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(DB_NAME, timeout=30, check_same_thread=False)
+            # WAL lets readers on other threads proceed while one thread writes
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self.local.conn = conn
+        return conn
+
+    def _is_healthy(self, conn):
+        if conn.closed:
+            return False
+        last_used = self.last_used.get(id(conn))
+        if last_used is None:
+            # Just opened by the pool, nothing to check yet
+            self.last_used[id(conn)] = time.monotonic()
+            return True
+        if time.monotonic() - last_used < DB_HEALTH_CHECK_IDLE:
+            return True
         try:
-            if self.is_postgres:
-                if self.conn.closed:
-                    self.connect()
-            return self.conn.cursor()
-        except:
-            self.connect()
-            return self.conn.cursor()
+            # Autocommit first: a ping in a transaction would leave it open and block the switch later
+            conn.autocommit = True
+            with conn.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            return True
+        except Exception:
+            return False
+
+    @contextmanager
+    def connection(self):
+        """Checks out a connection for the calling thread and returns it afterwards."""
+        if not self.is_postgres:
+            yield self._sqlite_connection()
+            return
+
+        self.pool_slots.acquire()
+        conn = None
+        try:
+            conn = self.pool.getconn()
+            if not self._is_healthy(conn):
+                self.last_used.pop(id(conn), None)
+                self.pool.putconn(conn, close=True)
+                conn = self.pool.getconn()
+            conn.autocommit = True
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            # Broken connection: drop it so the pool opens a fresh one next time
+            if conn is not None:
+                self.last_used.pop(id(conn), None)
+                self.pool.putconn(conn, close=True)
+                conn = None
+            raise
+        finally:
+            if conn is not None:
+                self.last_used[id(conn)] = time.monotonic()
+                self.pool.putconn(conn, close=bool(conn.closed))
+            self.pool_slots.release()
 
     def create_tables(self):
-        cursor = self.get_cursor()
+        with self.connection() as conn:
+            self._create_tables(conn)
+
+    def _create_tables(self, conn):
+        cursor = conn.cursor()
         
         # ID Auto-increment syntax difference
         id_type = "SERIAL PRIMARY KEY" if self.is_postgres else "INTEGER PRIMARY KEY"
@@ -83,6 +163,63 @@ class Database:
             )
         ''')
 
+        # Telegram copies of Drive files, so repeat downloads can be resent by file_id
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS document_cache (
+                drive_id TEXT PRIMARY KEY,
+                tg_file_id TEXT,
+                md5_checksum TEXT,
+                modified_time TEXT
+            )
+        ''')
+
+        # Folders below FOLDER_ID, so the catalog can tell which files belong to the library
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS drive_folders (
+                folder_id TEXT PRIMARY KEY,
+                parent_id TEXT,
+                name TEXT
+            )
+        ''')
+
+        # Broadcast jobs survive restarts: progress is a (phase, last_target) position in the
+        # users/chats tables, and deliveries record targets done since that position last moved
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS broadcast_jobs (
+                id {id_type},
+                admin_id BIGINT,
+                messages TEXT,
+                status TEXT DEFAULT 'running',
+                phase TEXT DEFAULT 'users',
+                last_target BIGINT,
+                total INTEGER DEFAULT 0,
+                success INTEGER DEFAULT 0,
+                failed INTEGER DEFAULT 0,
+                errors TEXT,
+                status_chat_id BIGINT,
+                status_message_id BIGINT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS broadcast_deliveries (
+                job_id INTEGER,
+                target_id BIGINT,
+                status TEXT,
+                PRIMARY KEY (job_id, target_id)
+            )
+        ''')
+
+        # Daily search counts per normalized query
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS search_stats (
+                day TEXT,
+                term TEXT,
+                count INTEGER DEFAULT 0,
+                PRIMARY KEY (day, term)
+            )
+        ''')
+
         # Table for general settings (like Google tokens)
         cursor.execute(f'''
             CREATE TABLE IF NOT EXISTS settings (
@@ -94,56 +231,231 @@ class Database:
         # Migrations (Handle columns if they don't exist)
         alter_commands = [
             'ALTER TABLE files ADD COLUMN file_size TEXT',
+            'ALTER TABLE files ADD COLUMN parent_id TEXT',
+            'ALTER TABLE files ADD COLUMN created_time TEXT',
+            'ALTER TABLE files ADD COLUMN modified_time TEXT',
+            'ALTER TABLE files ADD COLUMN md5_checksum TEXT',
             'ALTER TABLE chats ADD COLUMN chat_type TEXT',
             'ALTER TABLE chats ADD COLUMN username TEXT',
             'ALTER TABLE chats ADD COLUMN adder_id BIGINT',
             'ALTER TABLE chats ADD COLUMN adder_name TEXT',
             'ALTER TABLE users ADD COLUMN last_seen TIMESTAMP',
-            'ALTER TABLE users ADD COLUMN is_banned INTEGER DEFAULT 0'
+            'ALTER TABLE users ADD COLUMN is_banned INTEGER DEFAULT 0',
+            # Broadcast reachability: set when a send fails for good, counted for transient failures
+            'ALTER TABLE users ADD COLUMN blocked_at TIMESTAMP',
+            'ALTER TABLE users ADD COLUMN fail_count INTEGER DEFAULT 0',
+            'ALTER TABLE chats ADD COLUMN blocked_at TIMESTAMP',
+            'ALTER TABLE chats ADD COLUMN fail_count INTEGER DEFAULT 0'
         ]
         
         for cmd in alter_commands:
             try:
                 cursor.execute(cmd)
                 if not self.is_postgres:
-                    self.conn.commit()
+                    conn.commit()
             except Exception:
                 # Column likely exists
                 if self.is_postgres:
-                    self.conn.rollback() 
+                    conn.rollback() 
                 pass
 
+        # Drive files are keyed by their Drive ID (chat_id/message_id stay NULL)
+        cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_files_file_id ON files (file_id)')
+
+        self.text_index = self._create_text_index(conn)
+
         if not self.is_postgres:
-            self.conn.commit()
+            conn.commit()
+
+    def _create_text_index(self, conn):
+        """Indexes file names for search_files. Returns False if the backend lacks support."""
+        cursor = conn.cursor()
+        try:
+            if self.is_postgres:
+                # GIN indexes are maintained by Postgres itself on every write
+                cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+                cursor.execute('CREATE INDEX IF NOT EXISTS idx_files_name_trgm ON files USING gin (file_name gin_trgm_ops)')
+                return True
+
+            exists = cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'files_fts'").fetchone()
+            cursor.execute("CREATE VIRTUAL TABLE IF NOT EXISTS files_fts USING fts5(file_name, content='files', content_rowid='id')")
+            # Keep the external-content FTS table in step with files
+            cursor.execute('''
+                CREATE TRIGGER IF NOT EXISTS files_fts_insert AFTER INSERT ON files BEGIN
+                    INSERT INTO files_fts (rowid, file_name) VALUES (new.id, new.file_name);
+                END
+            ''')
+            cursor.execute('''
+                CREATE TRIGGER IF NOT EXISTS files_fts_delete AFTER DELETE ON files BEGIN
+                    INSERT INTO files_fts (files_fts, rowid, file_name) VALUES ('delete', old.id, old.file_name);
+                END
+            ''')
+            cursor.execute('''
+                CREATE TRIGGER IF NOT EXISTS files_fts_update AFTER UPDATE OF file_name ON files BEGIN
+                    INSERT INTO files_fts (files_fts, rowid, file_name) VALUES ('delete', old.id, old.file_name);
+                    INSERT INTO files_fts (rowid, file_name) VALUES (new.id, new.file_name);
+                END
+            ''')
+            if not exists:
+                # Index rows stored before the FTS table existed
+                cursor.execute("INSERT INTO files_fts (files_fts) VALUES ('rebuild')")
+            return True
+        except Exception as e:
+            logger.warning(f"File name index unavailable, search_files will scan the table: {e}")
+            conn.rollback()
+            return False
 
     def execute_query(self, query, params=(), fetch_one=False, fetch_all=False, commit=False):
         """Helper to execute queries with correct placeholder and error handling."""
-        cursor = self.get_cursor()
+        # Replace ? with %s if using Postgres
+        if self.is_postgres and "?" in query:
+            query = query.replace("?", "%s")
+
+        # One retry covers a pooled connection that died while idle
+        for attempt in range(2):
+            try:
+                with self.connection() as conn:
+                    cursor = conn.cursor()
+                    try:
+                        cursor.execute(query, params)
+
+                        if commit and not self.is_postgres:
+                            conn.commit()
+
+                        if fetch_one:
+                            return cursor.fetchone()
+                        if fetch_all:
+                            return cursor.fetchall()
+                        return cursor
+                    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                        raise
+                    except Exception as e:
+                        logger.error(f"Query Error: {e} | Query: {query}")
+                        conn.rollback()
+                        return None
+            except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+                logger.warning(f"Database connection lost ({e}), retrying...")
+        logger.error(f"Query Error: connection unavailable | Query: {query}")
+        return None
+
+    def execute_many(self, query, seq_params):
+        """Runs the same statement for every parameter tuple in one round of commits."""
+        if self.is_postgres and "?" in query:
+            query = query.replace("?", "%s")
+
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                if self.is_postgres:
+                    # Sends statements in pages instead of one round trip per row
+                    execute_batch(cursor, query, seq_params, page_size=500)
+                else:
+                    cursor.executemany(query, seq_params)
+
+                if not self.is_postgres:
+                    conn.commit()
+                return cursor
+            except Exception as e:
+                logger.error(f"Query Error: {e} | Query: {query}")
+                conn.rollback()
+                return None
+
+    def execute_transaction(self, statements):
+        """Runs [(query, seq_params), ...] in one transaction: all of it is stored or none.
+        Returns True on commit."""
         try:
-            # Replace ? with %s if using Postgres
-            if self.is_postgres and "?" in query:
-                query = query.replace("?", "%s")
-                
-            cursor.execute(query, params)
-            
-            if commit and not self.is_postgres:
-                self.conn.commit()
-                
-            if fetch_one:
-                return cursor.fetchone()
-            if fetch_all:
-                return cursor.fetchall()
-            return cursor
+            with self.connection() as conn:
+                if self.is_postgres:
+                    # Checkout puts it back in autocommit
+                    conn.autocommit = False
+                cursor = conn.cursor()
+                try:
+                    for query, seq_params in statements:
+                        if self.is_postgres:
+                            execute_batch(cursor, query.replace("?", "%s"), seq_params, page_size=500)
+                        else:
+                            cursor.executemany(query, seq_params)
+                    conn.commit()
+                    return True
+                except Exception:
+                    conn.rollback()
+                    raise
         except Exception as e:
-            logger.error(f"Query Error: {e} | Query: {query}")
-            if self.is_postgres:
-                self.conn.rollback()
-            return None
+            logger.error(f"Transaction Error: {e}")
+            return False
+
+    def iter_rows(self, query, params=(), batch_size=STREAM_BATCH_SIZE):
+        """Yields the rows of a large result a batch at a time instead of loading them all.
+
+        Postgres streams through a server-side (named) cursor, SQLite reads with fetchmany
+        on a connection of its own. Either way the generator may be advanced from any
+        thread, one at a time, and holds its connection until exhausted or closed.
+        """
+        if not self.is_postgres:
+            conn = sqlite3.connect(DB_NAME, timeout=30, check_same_thread=False)
+            try:
+                cursor = conn.execute(query, params)
+                while True:
+                    rows = cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    yield from rows
+            finally:
+                conn.close()
+            return
+
+        if "?" in query:
+            query = query.replace("?", "%s")
+        with self.connection() as conn:
+            # WITH HOLD lets the cursor outlive its transaction, so a long read (a whole
+            # broadcast) doesn't keep one open on the server
+            cursor = conn.cursor(name=f"stream_{next(cursor_names)}", withhold=True)
+            cursor.itersize = batch_size
+            try:
+                cursor.execute(query, params)
+                while True:
+                    rows = cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    yield from rows
+            finally:
+                if not conn.closed:
+                    cursor.close()
+
+    def _iter_target_ids(self, table, column, after_id=None):
+        if after_id is None:
+            rows = self.iter_rows(f'SELECT {column} FROM {table} WHERE {REACHABLE} ORDER BY {column}', (BROADCAST_MAX_FAILURES,))
+        else:
+            rows = self.iter_rows(f'SELECT {column} FROM {table} WHERE {REACHABLE} AND {column} > ? ORDER BY {column}', (BROADCAST_MAX_FAILURES, after_id))
+        for row in rows:
+            yield row[0]
+
+    def iter_user_ids(self, after_id=None):
+        """Yields ids of users that can be broadcast to, in id order, starting after after_id."""
+        self.flush_users()
+        return self._iter_target_ids('users', 'user_id', after_id)
+
+    def iter_chat_ids(self, after_id=None):
+        """Yields ids of chats that can be broadcast to, in id order, starting after after_id."""
+        return self._iter_target_ids('chats', 'chat_id', after_id)
+
+    def iter_broadcast_targets(self, phase, after_id=None, page_size=500):
+        """Yields pages of user ids (phase 'users') or chat ids (phase 'chats') after after_id,
+        in id order, read through a single streaming cursor."""
+        ids = self.iter_user_ids(after_id) if phase == 'users' else self.iter_chat_ids(after_id)
+        page = []
+        for target_id in ids:
+            page.append(target_id)
+            if len(page) == page_size:
+                yield page
+                page = []
+        if page:
+            yield page
 
     def add_chat(self, chat_id, title, username=None, chat_type=None, adder_id=None, adder_name=None):
         query = 'INSERT INTO chats (chat_id, title, username, chat_type, adder_id, adder_name) VALUES (?, ?, ?, ?, ?, ?)'
         if self.is_postgres:
-            query = 'INSERT INTO chats (chat_id, title, username, chat_type, adder_id, adder_name) VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (chat_id) DO UPDATE SET title = EXCLUDED.title, username = EXCLUDED.username, chat_type = EXCLUDED.chat_type, adder_id = EXCLUDED.adder_id, adder_name = EXCLUDED.adder_name'
+            query = 'INSERT INTO chats (chat_id, title, username, chat_type, adder_id, adder_name) VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (chat_id) DO UPDATE SET title = EXCLUDED.title, username = EXCLUDED.username, chat_type = EXCLUDED.chat_type, adder_id = EXCLUDED.adder_id, adder_name = EXCLUDED.adder_name, blocked_at = NULL, fail_count = 0'
         else:
              query = 'INSERT OR REPLACE INTO chats (chat_id, title, username, chat_type, adder_id, adder_name) VALUES (?, ?, ?, ?, ?, ?)'
              
@@ -154,13 +466,95 @@ class Database:
         return res is not None
 
     def get_all_chats(self):
-        rows = self.execute_query('SELECT chat_id FROM chats', fetch_all=True)
-        return [row[0] for row in rows] if rows else []
+        """Returns ids of chats that can still be broadcast to. Prefer iter_chat_ids for large tables."""
+        return list(self.iter_chat_ids())
 
     def get_all_chats_detailed(self):
         """Returns list of (chat_id, title, username, chat_type, adder_id, adder_name)"""
         return self.execute_query('SELECT chat_id, title, username, chat_type, adder_id, adder_name FROM chats', fetch_all=True) or []
 
+    def create_broadcast_job(self, admin_id, messages, total, status_chat_id, status_message_id):
+        """Stores a new running broadcast job and returns its id. `messages` is a JSON string."""
+        query = '''
+            INSERT INTO broadcast_jobs (admin_id, messages, total, status_chat_id, status_message_id)
+            VALUES (?, ?, ?, ?, ?)
+        '''
+        params = (admin_id, messages, total, status_chat_id, status_message_id)
+        if self.is_postgres:
+            res = self.execute_query(query + ' RETURNING id', params, fetch_one=True)
+            return res[0] if res else None
+        cursor = self.execute_query(query, params, commit=True)
+        return cursor.lastrowid if cursor else None
+
+    def get_broadcast_jobs(self, status='running'):
+        """Returns jobs with the given status as dicts."""
+        columns = ['id', 'admin_id', 'messages', 'status', 'phase', 'last_target', 'total', 'success', 'failed', 'errors', 'status_chat_id', 'status_message_id']
+        rows = self.execute_query(f"SELECT {', '.join(columns)} FROM broadcast_jobs WHERE status = ? ORDER BY id", (status,), fetch_all=True) or []
+        return [dict(zip(columns, row)) for row in rows]
+
+    def update_broadcast_job(self, job_id, phase, last_target, success, failed, errors, status='running'):
+        """Saves job progress."""
+        self.execute_query('''
+            UPDATE broadcast_jobs SET phase = ?, last_target = ?, success = ?, failed = ?, errors = ?, status = ?
+            WHERE id = ?
+        ''', (phase, last_target, success, failed, errors, status, job_id), commit=True)
+
+    def clear_broadcast_deliveries(self, job_id, target_ids=None):
+        """Drops delivery records no longer needed for resuming (all of them if target_ids is None)."""
+        if target_ids is None:
+            self.execute_query('DELETE FROM broadcast_deliveries WHERE job_id = ?', (job_id,), commit=True)
+        elif target_ids:
+            self.execute_many('DELETE FROM broadcast_deliveries WHERE job_id = ? AND target_id = ?', [(job_id, t) for t in target_ids])
+
+    def record_broadcast_delivery(self, job_id, target_id, status):
+        if self.is_postgres:
+            query = 'INSERT INTO broadcast_deliveries (job_id, target_id, status) VALUES (?, ?, ?) ON CONFLICT (job_id, target_id) DO NOTHING'
+        else:
+            query = 'INSERT OR IGNORE INTO broadcast_deliveries (job_id, target_id, status) VALUES (?, ?, ?)'
+        self.execute_query(query, (job_id, target_id, status), commit=True)
+
+    def get_broadcast_deliveries(self, job_id):
+        """Returns {target_id: status} for targets handled past the job's last_target."""
+        rows = self.execute_query('SELECT target_id, status FROM broadcast_deliveries WHERE job_id = ?', (job_id,), fetch_all=True)
+        if rows is None:
+            # Treating this as "nothing delivered yet" would resend to those targets
+            raise Exception(f"Could not read deliveries of broadcast job {job_id}")
+        return dict(rows)
+
+    def get_broadcast_target_count(self):
+        """Number of users and chats a broadcast would be sent to."""
+        self.flush_users()
+        users = self.execute_query(f'SELECT COUNT(*) FROM users WHERE {REACHABLE}', (BROADCAST_MAX_FAILURES,), fetch_one=True)
+        chats = self.execute_query(f'SELECT COUNT(*) FROM chats WHERE {REACHABLE}', (BROADCAST_MAX_FAILURES,), fetch_one=True)
+        return (users[0] if users else 0) + (chats[0] if chats else 0)
+
+    def get_unreachable_count(self):
+        """Number of users and chats skipped by broadcasts."""
+        total = 0
+        for table in ('users', 'chats'):
+            res = self.execute_query(f'SELECT COUNT(*) FROM {table} WHERE NOT ({REACHABLE})', (BROADCAST_MAX_FAILURES,), fetch_one=True)
+            total += res[0] if res else 0
+        return total
+
+    def record_target_outcomes(self, phase, outcomes):
+        """Applies broadcast results, {target_id: 'sent' | 'dead' | 'failed' | 'skipped'}, to the users or chats table.
+
+        'dead' targets (blocked the bot, deleted, kicked it) are skipped from then on;
+        'failed' ones after BROADCAST_MAX_FAILURES failures in a row. 'skipped' ones (FloodWait,
+        network errors) are left as they were.
+        """
+        table, column = ('users', 'user_id') if phase == 'users' else ('chats', 'chat_id')
+        now = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+        sent = [(t,) for t, outcome in outcomes.items() if outcome == 'sent']
+        dead = [(now, t) for t, outcome in outcomes.items() if outcome == 'dead']
+        failed = [(t,) for t, outcome in outcomes.items() if outcome == 'failed']
+        if sent:
+            self.execute_many(f'UPDATE {table} SET fail_count = 0 WHERE {column} = ? AND fail_count > 0', sent)
+        if dead:
+            self.execute_many(f'UPDATE {table} SET blocked_at = ? WHERE {column} = ?', dead)
+        if failed:
+            self.execute_many(f'UPDATE {table} SET fail_count = COALESCE(fail_count, 0) + 1 WHERE {column} = ?', failed)
+
     def add_file(self, file_id, file_name, file_size, file_type, chat_id, message_id):
         if self.is_postgres:
             query = '''
@@ -175,75 +569,301 @@ class Database:
             '''
         self.execute_query(query, (file_id, file_name, file_size, file_type, chat_id, message_id), commit=True)
 
+    def upsert_drive_files(self, files):
+        """Stores Drive file metadata (as returned by the Drive API) in the files table."""
+        if not files:
+            return
+        excluded = "EXCLUDED" if self.is_postgres else "excluded"
+        query = f'''
+            INSERT INTO files (file_id, file_name, file_size, file_type, parent_id, md5_checksum, created_time, modified_time)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (file_id) DO UPDATE SET
+                file_name = {excluded}.file_name,
+                file_size = {excluded}.file_size,
+                file_type = {excluded}.file_type,
+                parent_id = {excluded}.parent_id,
+                md5_checksum = {excluded}.md5_checksum,
+                created_time = {excluded}.created_time,
+                modified_time = {excluded}.modified_time
+        '''
+        rows = [
+            (
+                f['id'], f.get('name'), f.get('size'), f.get('mimeType'),
+                (f.get('parents') or [None])[0], f.get('md5Checksum'), f.get('createdTime'), f.get('modifiedTime')
+            )
+            for f in files
+        ]
+        self.execute_many(query, rows)
+
+    def delete_drive_files(self, file_ids):
+        if not file_ids:
+            return
+        params = [(fid,) for fid in file_ids]
+        self.execute_many('DELETE FROM files WHERE file_id = ?', params)
+        self.execute_many('DELETE FROM document_cache WHERE drive_id = ?', params)
+
+    def upsert_drive_folders(self, folders):
+        """Stores Drive folders (as returned by the Drive API) in the drive_folders table."""
+        if not folders:
+            return
+        excluded = "EXCLUDED" if self.is_postgres else "excluded"
+        query = f'''
+            INSERT INTO drive_folders (folder_id, parent_id, name)
+            VALUES (?, ?, ?)
+            ON CONFLICT (folder_id) DO UPDATE SET
+                parent_id = {excluded}.parent_id,
+                name = {excluded}.name
+        '''
+        self.execute_many(query, [(f['id'], (f.get('parents') or [None])[0], f.get('name')) for f in folders])
+
+    def delete_drive_folders(self, folder_ids):
+        if folder_ids:
+            self.execute_many('DELETE FROM drive_folders WHERE folder_id = ?', [(fid,) for fid in folder_ids])
+
+    def get_drive_folders(self):
+        """Returns {folder_id: parent_id} for every stored folder."""
+        rows = self.execute_query('SELECT folder_id, parent_id FROM drive_folders', fetch_all=True) or []
+        return dict(rows)
+
+    def get_drive_files(self):
+        """Returns Drive files from the local index as dicts shaped like Drive API results."""
+        rows = self.execute_query('''
+            SELECT file_id, file_name, file_size, file_type, parent_id, md5_checksum, created_time, modified_time
+            FROM files
+            WHERE chat_id IS NULL
+        ''', fetch_all=True) or []
+        return [
+            {
+                'id': file_id, 'name': name, 'size': size, 'mimeType': mime_type,
+                'parents': [parent_id] if parent_id else [], 'md5Checksum': md5_checksum,
+                'createdTime': created_time, 'modifiedTime': modified_time
+            }
+            for file_id, name, size, mime_type, parent_id, md5_checksum, created_time, modified_time in rows
+        ]
+
+    def get_cached_document(self, drive_id):
+        """Returns (tg_file_id, md5_checksum, modified_time) for a Drive file already sent to Telegram."""
+        return self.execute_query('SELECT tg_file_id, md5_checksum, modified_time FROM document_cache WHERE drive_id = ?', (drive_id,), fetch_one=True)
+
+    def cache_document(self, drive_id, tg_file_id, md5_checksum=None, modified_time=None):
+        if self.is_postgres:
+            query = 'INSERT INTO document_cache (drive_id, tg_file_id, md5_checksum, modified_time) VALUES (?, ?, ?, ?) ON CONFLICT (drive_id) DO UPDATE SET tg_file_id = EXCLUDED.tg_file_id, md5_checksum = EXCLUDED.md5_checksum, modified_time = EXCLUDED.modified_time'
+        else:
+            query = 'INSERT OR REPLACE INTO document_cache (drive_id, tg_file_id, md5_checksum, modified_time) VALUES (?, ?, ?, ?)'
+        self.execute_query(query, (drive_id, tg_file_id, md5_checksum, modified_time), commit=True)
+
+    def delete_cached_document(self, drive_id):
+        self.execute_query('DELETE FROM document_cache WHERE drive_id = ?', (drive_id,), commit=True)
+
     def search_files(self, query):
-        sql = '''
+        """Returns up to 50 files whose name matches every word of the query, best match first."""
+        words = query.split()
+        if not words:
+            return []
+
+        if self.text_index and not self.is_postgres:
+            # FTS5 prefix query: every word must start a word of the name
+            match = " ".join('"' + word.replace('"', '""') + '"*' for word in words)
+            sql = '''
+                SELECT f.file_id, f.file_name, f.file_size, f.file_type, f.chat_id, f.message_id
+                FROM files_fts
+                JOIN files f ON f.id = files_fts.rowid
+                WHERE files_fts MATCH ?
+                ORDER BY files_fts.rank
+                LIMIT 50
+            '''
+            return self.execute_query(sql, (match,), fetch_all=True) or []
+
+        # ILIKE/LIKE per word; on Postgres the trigram index serves these and ranks by similarity
+        like = "ILIKE" if self.is_postgres else "LIKE"
+        conditions = " AND ".join(f"file_name {like} ?" for _ in words)
+        params = [f'%{word}%' for word in words]
+        order = ""
+        if self.is_postgres and self.text_index:
+            order = "ORDER BY similarity(file_name, ?) DESC"
+            params.append(query)
+        sql = f'''
             SELECT file_id, file_name, file_size, file_type, chat_id, message_id 
             FROM files 
-            WHERE file_name LIKE ? 
+            WHERE {conditions}
+            {order}
             LIMIT 50
         '''
-        return self.execute_query(sql, (f'%{query}%',), fetch_all=True) or []
+        return self.execute_query(sql, tuple(params), fetch_all=True) or []
+
+    def add_user(self, user_id, name=None, username=None, private=False):
+        """Records user activity. Writes are buffered and applied in batches by flush_users().
+        Never blocks, so handlers call it straight from the event loop.
+
+        Only activity in a private chat with the bot (`private`) proves it can message the
+        user again, so only that clears their blocked_at and fail_count.
+        """
+        last_seen = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+        with self.pending_lock:
+            earlier = self.pending_users.get(user_id)
+            private = private or bool(earlier and earlier[3])
+            self.pending_users[user_id] = (name, username, last_seen, private)
+            full = len(self.pending_users) >= USER_FLUSH_SIZE
+        if full:
+            pool.submit(self.flush_users)
+
+    def flush_users(self):
+        """Writes all buffered add_user calls in one batch. Returns the number of users written."""
+        with self.pending_lock:
+            if not self.pending_users:
+                return 0
+            pending, self.pending_users = self.pending_users, {}
 
-    def add_user(self, user_id, name=None, username=None):
         if self.is_postgres:
             query = '''
                 INSERT INTO users (user_id, name, username, last_seen) 
-                VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+                VALUES (?, ?, ?, ?)
                 ON CONFLICT(user_id) DO UPDATE SET
                     name = EXCLUDED.name,
                     username = EXCLUDED.username,
-                    last_seen = CURRENT_TIMESTAMP
+                    last_seen = EXCLUDED.last_seen,
+                    blocked_at = CASE WHEN ? = 1 THEN NULL ELSE users.blocked_at END,
+                    fail_count = CASE WHEN ? = 1 THEN 0 ELSE users.fail_count END
             '''
         else:
             query = '''
                 INSERT INTO users (user_id, name, username, last_seen) 
-                VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+                VALUES (?, ?, ?, ?)
                 ON CONFLICT(user_id) DO UPDATE SET
                     name = excluded.name,
                     username = excluded.username,
-                    last_seen = CURRENT_TIMESTAMP
+                    last_seen = excluded.last_seen,
+                    blocked_at = CASE WHEN ? = 1 THEN NULL ELSE users.blocked_at END,
+                    fail_count = CASE WHEN ? = 1 THEN 0 ELSE users.fail_count END
             '''
-        self.execute_query(query, (user_id, name, username), commit=True)
+        rows = [
+            (user_id, name, username, last_seen, int(private), int(private))
+            for user_id, (name, username, last_seen, private) in pending.items()
+        ]
+        if self.execute_many(query, rows) is None:
+            # Keep the batch for the next flush, unless newer activity replaced it meanwhile
+            with self.pending_lock:
+                for user_id, entry in pending.items():
+                    newer = self.pending_users.get(user_id)
+                    self.pending_users[user_id] = newer[:3] + (newer[3] or entry[3],) if newer else entry
+            return 0
+        return len(rows)
 
     def get_all_users(self):
-        rows = self.execute_query('SELECT user_id FROM users', fetch_all=True)
-        return [row[0] for row in rows] if rows else []
+        """Returns ids of users that can still be broadcast to. Prefer iter_user_ids for large tables."""
+        return list(self.iter_user_ids())
+
+    def increment_setting(self, key, amount=1):
+        """Atomically adds amount to an integer setting."""
+        query, params = self._increment_setting_query(key, amount)
+        self.execute_query(query, params, commit=True)
 
-    def increment_search_count(self):
+    def _increment_setting_query(self, key, amount):
         if self.is_postgres:
-            query = "INSERT INTO settings (key, value) VALUES ('total_searches', '1') ON CONFLICT (key) DO UPDATE SET value = (settings.value::int + 1)::text"
-        else:
-            query = "INSERT OR REPLACE INTO settings (key, value) VALUES ('total_searches', COALESCE((SELECT CAST(value AS INTEGER) FROM settings WHERE key = 'total_searches'), 0) + 1)"
-        
-        self.execute_query(query, commit=True)
+            query = "INSERT INTO settings (key, value) VALUES (?, ?) ON CONFLICT (key) DO UPDATE SET value = (settings.value::int + EXCLUDED.value::int)::text"
+            return query, (key, str(amount))
+        query = "INSERT OR REPLACE INTO settings (key, value) VALUES (?, COALESCE((SELECT CAST(value AS INTEGER) FROM settings WHERE key = ?), 0) + ?)"
+        return query, (key, key, amount)
+
+    def increment_search_count(self, query=""):
+        """Counts a search in memory; flush_search_counts() writes the totals."""
+        day = datetime.utcnow().strftime('%Y-%m-%d')
+        term = " ".join(query.lower().split())[:100]
+        with self.pending_lock:
+            self.pending_searches[(day, term)] += 1
+
+    def flush_search_counts(self):
+        """Adds the searches counted since the last flush to the stored totals, in one transaction."""
+        with self.pending_lock:
+            if not self.pending_searches:
+                return 0
+            pending, self.pending_searches = self.pending_searches, Counter()
+
+        total = sum(pending.values())
+        excluded = "EXCLUDED" if self.is_postgres else "excluded"
+        query = f'''
+            INSERT INTO search_stats (day, term, count) VALUES (?, ?, ?)
+            ON CONFLICT (day, term) DO UPDATE SET count = search_stats.count + {excluded}.count
+        '''
+        rows = [(day, term, count) for (day, term), count in pending.items()]
+        total_query, total_params = self._increment_setting_query('total_searches', total)
+        if not self.execute_transaction([(query, rows), (total_query, [total_params])]):
+            # Nothing was stored: count them again next time
+            with self.pending_lock:
+                self.pending_searches.update(pending)
+            return 0
+        return total
 
     def get_total_searches(self):
         res = self.get_setting('total_searches', '0')
+        with self.pending_lock:
+            pending = sum(self.pending_searches.values())
         try:
-            return int(res)
+            return int(res) + pending
         except:
-            return 0
+            return pending
+
+    def get_searches_since(self, days=0):
+        """Total searches today (days=0) or over the last `days` days plus today."""
+        self.flush_search_counts()
+        since = (datetime.utcnow() - timedelta(days=days)).strftime('%Y-%m-%d')
+        res = self.execute_query('SELECT SUM(count) FROM search_stats WHERE day >= ?', (since,), fetch_one=True)
+        return (res[0] or 0) if res else 0
+
+    def get_top_searches(self, days=7, limit=5):
+        """Returns [(term, count)] for the most searched queries of the last `days` days."""
+        self.flush_search_counts()
+        since = (datetime.utcnow() - timedelta(days=days)).strftime('%Y-%m-%d')
+        return self.execute_query('''
+            SELECT term, SUM(count) AS total FROM search_stats
+            WHERE day >= ? AND term != ''
+            GROUP BY term ORDER BY total DESC LIMIT ?
+        ''', (since, limit), fetch_all=True) or []
 
     def get_user_count(self):
+        self.flush_users()
         res = self.execute_query('SELECT COUNT(*) FROM users', fetch_one=True)
         return res[0] if res else 0
 
     def set_ban_status(self, identifier, status):
         """identifier can be user_id (int) or username (str)"""
+        self.flush_users()
         if isinstance(identifier, int) or str(identifier).isdigit():
-            user_id = int(identifier)
-            cursor = self.execute_query('UPDATE users SET is_banned = ? WHERE user_id = ?', (status, user_id), commit=True)
+            rows = self.execute_query('SELECT user_id FROM users WHERE user_id = ?', (int(identifier),), fetch_all=True)
         else:
             username = str(identifier).replace("@", "")
-            cursor = self.execute_query('UPDATE users SET is_banned = ? WHERE LOWER(username) = LOWER(?)', (status, username), commit=True)
-        
-        return cursor.rowcount > 0 if cursor else False
+            rows = self.execute_query('SELECT user_id FROM users WHERE LOWER(username) = LOWER(?)', (username,), fetch_all=True)
+        if not rows:
+            return False
+
+        user_ids = [row[0] for row in rows]
+        self.execute_many('UPDATE users SET is_banned = ? WHERE user_id = ?', [(status, user_id) for user_id in user_ids])
+        if status:
+            self.banned_users.update(user_ids)
+        else:
+            self.banned_users.difference_update(user_ids)
+        # Tell other workers their ban cache is stale
+        self.increment_setting('ban_version')
+        return True
+
+    def load_bans(self):
+        """Reloads the cached set of banned user ids."""
+        version = self.get_setting('ban_version', '0')
+        rows = self.execute_query('SELECT user_id FROM users WHERE is_banned = 1', fetch_all=True) or []
+        self.banned_users = {row[0] for row in rows}
+        self.ban_version = version
+
+    def refresh_bans(self):
+        """Reloads the ban cache if another worker changed bans since it was loaded."""
+        if self.get_setting('ban_version', '0') != self.ban_version:
+            self.load_bans()
 
     def is_user_banned(self, user_id):
-        res = self.execute_query('SELECT is_banned FROM users WHERE user_id = ?', (user_id,), fetch_one=True)
-        return res[0] == 1 if res else False
+        # Memory only (refresh_bans runs in the background), so safe on the event loop
+        return user_id in self.banned_users
 
     def get_user_by_id_or_username(self, identifier):
+        self.flush_users()
         if isinstance(identifier, int) or str(identifier).isdigit():
             return self.execute_query('SELECT user_id, name, username FROM users WHERE user_id = ?', (int(identifier),), fetch_one=True)
         else:
@@ -251,6 +871,7 @@ class Database:
             return self.execute_query('SELECT user_id, name, username FROM users WHERE LOWER(username) = LOWER(?)', (username,), fetch_one=True)
 
     def get_monthly_user_count(self):
+        self.flush_users()
         # Postgres uses slightly different syntax for date math
         if self.is_postgres:
             query = "SELECT COUNT(*) FROM users WHERE last_seen >= NOW() - INTERVAL '30 days'"
@@ -282,3 +903,4 @@ class Database:
         return res[0] if res else default
 
 db = Database()
+adb = AsyncProxy(db)
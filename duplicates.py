@@ -0,0 +1,59 @@
+# duplicates.py
+import re
+
+# "Copy of x.srt", "x (1).srt", "x - Copy.srt": names Drive and desktop clients give re-uploads
+COPY_MARKERS = re.compile(r"^copy of |\s*\(\d+\)(?=\.[^.]*$|$)|\s*-\s*copy(?=\.[^.]*$|$)")
+SEPARATORS = re.compile(r"[\s._\-]+")
+
+def normalize_name(name):
+    """Lowercases a file name and strips copy markers and separator differences."""
+    name = COPY_MARKERS.sub("", (name or "").lower())
+    return SEPARATORS.sub(" ", name).strip()
+
+def file_size(f):
+    try:
+        return int(f.get('size') or 0)
+    except (TypeError, ValueError):
+        return 0
+
+def find_duplicates(files):
+    """Groups duplicate Drive files.
+
+    First, files with the same md5Checksum and size are duplicates whatever they are
+    called. Then files Drive reports no hash for are matched on normalized name plus
+    size, together with at most one hashed file: two different hashes are two different
+    files, such as a corrected re-upload, whatever their names. Empty files are never
+    matched: they all share one hash. Returns a list of groups, each
+    {'keep': oldest file, 'remove': [other files], 'match': 'content' | 'name'},
+    largest reclaimable size first.
+    """
+    files = [f for f in files if file_size(f) > 0]
+
+    groups = []
+    removed = set()
+    passes = (
+        ('content', lambda f: (f['md5Checksum'], file_size(f)) if f.get('md5Checksum') else None),
+        ('name', lambda f: (normalize_name(f.get('name')), file_size(f))),
+    )
+    for match, key in passes:
+        grouped = {}
+        for f in files:
+            k = key(f)
+            if k is not None and f['id'] not in removed:
+                grouped.setdefault(k, []).append(f)
+        for group in grouped.values():
+            if match == 'name' and sum(1 for f in group if f.get('md5Checksum')) > 1:
+                # Distinct contents share this name: only the unhashed files can be copies
+                group = [f for f in group if not f.get('md5Checksum')]
+            if len(group) < 2:
+                continue
+            # Keep the oldest upload
+            group.sort(key=lambda f: (f.get('createdTime') or '', f['id']))
+            groups.append({'keep': group[0], 'remove': group[1:], 'match': match})
+            removed.update(f['id'] for f in group[1:])
+
+    groups.sort(key=lambda g: -reclaimable_bytes([g]))
+    return groups
+
+def reclaimable_bytes(groups):
+    return sum(file_size(f) for g in groups for f in g['remove'])
@@ -0,0 +1,55 @@
+# executor.py
+import asyncio
+import functools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from config import WORKER_THREADS
+
+logger = logging.getLogger(__name__)
+
+# Bounded pool for blocking Drive and database calls, so they never run on the event loop
+pool = ThreadPoolExecutor(max_workers=WORKER_THREADS, thread_name_prefix="worker")
+
+async def run_blocking(func, *args, **kwargs):
+    """Runs a blocking function on the worker pool and waits for its result."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(pool, functools.partial(func, *args, **kwargs))
+
+async def run_every(interval, func, *args):
+    """Calls a blocking function on the pool every `interval` seconds until cancelled."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await run_blocking(func, *args)
+        except Exception as e:
+            logger.error(f"Periodic {func.__name__} error: {e}")
+
+async def iterate_blocking(iterator):
+    """Async iteration over a blocking iterator (e.g. a generator doing I/O), advanced on the pool."""
+    done = object()
+    while True:
+        item = await run_blocking(next, iterator, done)
+        if item is done:
+            return
+        yield item
+
+class AsyncProxy:
+    """Async facade over a blocking object: every method call becomes a coroutine run on the pool.
+
+    Plain attributes are returned as-is, e.g. `await adb.get_user_count()` but `adb.is_postgres`.
+    """
+
+    def __init__(self, target):
+        self._target = target
+
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        if not callable(attr):
+            return attr
+
+        @functools.wraps(attr)
+        async def wrapper(*args, **kwargs):
+            return await run_blocking(attr, *args, **kwargs)
+
+        return wrapper
@@ -3,19 +3,72 @@ import pickle
 import io
 import mimetypes
 import base64
+import random
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime, timedelta
+import httplib2
+import requests
 from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
+from google.auth.transport.requests import Request, AuthorizedSession
 from googleapiclient.discovery import build
 from googleapiclient.http import MediaIoBaseDownload
+from config import DRIVE_CRAWL_CONCURRENCY, DRIVE_BATCH_CONCURRENCY
+from executor import AsyncProxy
 
 # If modifying these scopes, delete the file token.pickle.
 SCOPES = ['https://www.googleapis.com/auth/drive']
+FOLDER_MIME = 'application/vnd.google-apps.folder'
+
+# Long-lived threads for parallel Drive calls (tree walks, batch deletes), so each keeps its
+# service and HTTP session between calls. Separate from executor.pool, whose threads wait on these.
+drive_pool = ThreadPoolExecutor(
+    max_workers=max(DRIVE_CRAWL_CONCURRENCY, DRIVE_BATCH_CONCURRENCY), thread_name_prefix="drive"
+)
+
+class SessionHttp:
+    """httplib2.Http stand-in backed by a requests AuthorizedSession, for build(http=...).
+
+    requests keeps connections to googleapis alive in a pool, so consecutive calls on a
+    thread skip the TCP and TLS handshakes httplib2 would repeat. The session adds and
+    refreshes the OAuth header itself. One instance per thread: sessions are not shared.
+    Drive calls run on the long-lived executor.pool and drive_pool threads, so each
+    session is reused for the life of the process and closed when its credentials change.
+    """
+
+    def __init__(self, credentials, timeout=120):
+        self.credentials = credentials # Read by googleapiclient for batch requests
+        self.timeout = timeout
+        self.session = AuthorizedSession(credentials)
+        # Downloads and batch calls may overlap with API calls on the same thread's session
+        self.session.mount('https://', requests.adapters.HTTPAdapter(pool_connections=2, pool_maxsize=4))
+
+    def request(self, uri, method="GET", body=None, headers=None, redirections=5, connection_type=None):
+        response = self.session.request(
+            method, uri, data=body, headers=headers, timeout=self.timeout, allow_redirects=redirections > 0
+        )
+        info = dict(response.headers)
+        info['status'] = str(response.status_code)
+        return httplib2.Response(info), response.content
+
+    def close(self):
+        self.session.close()
 
 class GoogleDriveHandler:
     def __init__(self, credentials_path='credentials.json', token_path='token.pickle'):
         self.credentials_path = credentials_path
         self.token_path = token_path
         self.service = None
+        self.creds = None
+        # Services and their HTTP sessions are not thread-safe, so every worker thread builds its own
+        self._local = threading.local()
+        # Auth state lives in memory: while unauthorized, token file and DB checks are
+        # repeated at most once per AUTH_NEGATIVE_TTL instead of on every message
+        self._auth_lock = threading.RLock()
+        self.unauthorized_until = 0
         
         # Heroku Support: Rebuild files from environment variables if missing
         env_creds = os.environ.get("GDRIVE_CREDENTIALS")
@@ -44,15 +97,53 @@ class GoogleDriveHandler:
         return auth_url
 
     def get_service(self):
-        """Returns the Drive service, authenticating if necessary."""
-        if self.service:
-            return self.service
-        if self.authenticate():
-            return self.service
-        return None
+        """Returns the calling thread's Drive service, authenticating if necessary."""
+        if not self.service and not self.is_authenticated():
+            return None
+
+        local = self._local
+        if getattr(local, 'creds', None) is not self.creds:
+            if getattr(local, 'service', None) is not None:
+                local.service.close()
+            local.service = self._build_service(self.creds)
+            local.creds = self.creds
+        return local.service
+
+    def _build_service(self, creds):
+        return build('drive', 'v3', http=SessionHttp(creds), cache_discovery=False)
+
+    def _set_service(self, service):
+        # Close the replaced service's session, or its pooled connections stay open
+        old, self.service = self.service, service
+        if old is not None:
+            old.close()
 
     def authenticate(self, auth_code=None):
         """Authenticates with the given code or existing token."""
+        from config import AUTH_NEGATIVE_TTL
+
+        with self._auth_lock:
+            if auth_code:
+                # A new code may succeed where the stored token failed
+                self.unauthorized_until = 0
+            authorized = self._authenticate(auth_code)
+            self.unauthorized_until = 0 if authorized else time.monotonic() + AUTH_NEGATIVE_TTL
+            return authorized
+
+    def _authenticate(self, auth_code=None):
+        # 1. Load from DB first
+        # (before reading the file, or a fresh dyno would count as unauthorized until the next check)
+        from database import db
+        if not os.path.exists(self.token_path):
+            db_token = db.get_setting("gdrive_token")
+            if db_token:
+                try:
+                    with open(self.token_path, 'wb') as f:
+                        f.write(base64.b64decode(db_token))
+                    print("Loaded token.pickle from Database.")
+                except Exception as e:
+                    print(f"Error loading token from DB: {e}")
+
         creds = None
         if os.path.exists(self.token_path):
             with open(self.token_path, 'rb') as token:
@@ -61,17 +152,6 @@ class GoogleDriveHandler:
                 except Exception as e:
                     print(f"Error loading token: {e}")
                     creds = None
-        
-        # 1. Load from DB first
-        from database import db
-        db_token = db.get_setting("gdrive_token")
-        if db_token and not os.path.exists(self.token_path):
-            try:
-                with open(self.token_path, 'wb') as f:
-                    f.write(base64.b64decode(db_token))
-                print("Loaded token.pickle from Database.")
-            except Exception as e:
-                print(f"Error loading token from DB: {e}")
 
         # If there are no (valid) credentials available, let the user log in.
         try:
@@ -94,16 +174,11 @@ class GoogleDriveHandler:
                 else:
                     return False
 
-                # Save the credentials for the next run
-                with open(self.token_path, 'wb') as token:
-                    pickle.dump(creds, token)
-                
-                # Also save to DB for Heroku persistence
-                with open(self.token_path, 'rb') as token:
-                    db.set_setting("gdrive_token", base64.b64encode(token.read()).decode('utf-8'))
+                self._save_token(creds)
 
             # Optimization: Use a higher cache discovery level if needed, but build is usually fine
-            self.service = build('drive', 'v3', credentials=creds, cache_discovery=False)
+            self.creds = creds
+            self._set_service(self._build_service(creds))
             return True
         except Exception as e:
             print(f"Authentication error: {e}")
@@ -115,10 +190,62 @@ class GoogleDriveHandler:
                 return False
             raise e # Raise to surface other actual errors (e.g., SSL issues)
 
+    def _save_token(self, creds):
+        from database import db
+
+        # Save the credentials for the next run
+        with open(self.token_path, 'wb') as token:
+            pickle.dump(creds, token)
+
+        # Also save to DB for Heroku persistence
+        with open(self.token_path, 'rb') as token:
+            db.set_setting("gdrive_token", base64.b64encode(token.read()).decode('utf-8'))
+
     def is_authenticated(self):
+        # Fast paths: known authorized, or known unauthorized and not due for a recheck
         if self.service:
             return True
-        return self.authenticate()
+        if time.monotonic() < self.unauthorized_until:
+            return False
+
+        with self._auth_lock:
+            # Another thread may have settled it while we waited
+            if self.service:
+                return True
+            if time.monotonic() < self.unauthorized_until:
+                return False
+            return self.authenticate()
+
+    def refresh_if_expiring(self):
+        """Refreshes the access token shortly before it expires, so no request has to wait
+        on a refresh. Returns True if the token was refreshed."""
+        from config import AUTH_REFRESH_MARGIN, AUTH_NEGATIVE_TTL
+
+        creds = self.creds
+        if not creds or not creds.refresh_token or not creds.expiry:
+            return False
+        # google-auth keeps expiry as naive UTC
+        if creds.expiry - datetime.utcnow() > timedelta(seconds=AUTH_REFRESH_MARGIN):
+            return False
+
+        with self._auth_lock:
+            try:
+                # Threads share this credentials object, so their sessions pick up the new token
+                creds.refresh(Request())
+            except Exception as e:
+                print(f"Background token refresh failed: {e}")
+                if "invalid_grant" in str(e).lower():
+                    # Revoked or expired for good: fall back to asking an admin for a code
+                    from database import db
+                    if os.path.exists(self.token_path):
+                        os.remove(self.token_path)
+                    db.set_setting("gdrive_token", None)
+                    self._set_service(None)
+                    self.creds = None
+                    self.unauthorized_until = time.monotonic() + AUTH_NEGATIVE_TTL
+                return False
+            self._save_token(creds)
+        return True
 
     def search_files(self, query):
         """Searches for files in Google Drive by name, restricted to a specific folder."""
@@ -133,7 +260,7 @@ class GoogleDriveHandler:
         
         # query: name contains '...' and not mimeType = 'application/vnd.google-apps.folder'
         # Also restricted to the specific folder ID if provided
-        q = f"name contains '{safe_query}' and mimeType != 'application/vnd.google-apps.folder' and trashed = false"
+        q = f"name contains '{safe_query}' and mimeType != '{FOLDER_MIME}' and trashed = false"
         if FOLDER_ID:
             q += f" and '{FOLDER_ID}' in parents"
             
@@ -151,6 +278,14 @@ class GoogleDriveHandler:
             print(f"Search error: {e}")
             return []
 
+    def get_file_info(self, file_id, fields="id, name, size, md5Checksum, modifiedTime"):
+        """Fetches metadata for a single file."""
+        service = self.get_service()
+        if not service:
+            raise Exception("Drive service not initialized")
+
+        return service.files().get(fileId=file_id, fields=fields, supportsAllDrives=True).execute()
+
     def download_file(self, file_id, file_name):
         """Downloads a file from Google Drive and returns the path."""
         service = self.get_service()
@@ -175,6 +310,36 @@ class GoogleDriveHandler:
         
         return file_path
 
+    def download_to_buffer(self, file_id, size=None):
+        """Downloads a file into a seekable buffer without writing it to the downloads folder.
+
+        Files up to STREAM_MEMORY_LIMIT bytes (or of unknown size) stay in memory; larger
+        files go to an anonymous temp file. The caller must close the returned buffer.
+        """
+        service = self.get_service()
+        if not service:
+            raise Exception("Drive service not initialized")
+
+        from config import STREAM_MEMORY_LIMIT
+
+        request = service.files().get_media(fileId=file_id, supportsAllDrives=True)
+        if size is not None and int(size) > STREAM_MEMORY_LIMIT:
+            buffer = tempfile.TemporaryFile()
+        else:
+            buffer = io.BytesIO()
+
+        try:
+            downloader = MediaIoBaseDownload(buffer, request, chunksize=1024*1024*5)
+            done = False
+            while done is False:
+                status, done = downloader.next_chunk()
+        except Exception:
+            buffer.close()
+            raise
+
+        buffer.seek(0)
+        return buffer
+
     def delete_file(self, file_id):
         """Permanently deletes a file from Google Drive."""
         service = self.get_service()
@@ -189,18 +354,114 @@ class GoogleDriveHandler:
             print(f"🔴 Delete (trash) error for {file_id}: {e}")
             raise e
 
-    def get_all_files(self):
-        """Fetches all files from the configured folder using pagination."""
+    def trash_files(self, file_ids):
+        """Moves many files to the trash using Drive batch requests.
+
+        Ids go out DRIVE_BATCH_SIZE per HTTP batch with up to DRIVE_BATCH_CONCURRENCY
+        batches in flight on drive_pool. Items refused for rate limits or server errors
+        are retried with exponential backoff. Returns (trashed_ids, {file_id: error}).
+        """
+        if not self.get_service():
+            raise Exception("Drive service not initialized")
+
+        from config import DRIVE_BATCH_SIZE, DRIVE_BATCH_RETRIES
+
+        trashed = []
+        errors = {}
+        pending = {file_id: None for file_id in file_ids} # {file_id: last retryable error}
+        for attempt in range(DRIVE_BATCH_RETRIES + 1):
+            if not pending:
+                break
+            if attempt:
+                time.sleep(min(2 ** attempt, 32) + random.random())
+
+            ids = list(pending)
+            batches = [ids[i:i + DRIVE_BATCH_SIZE] for i in range(0, len(ids), DRIVE_BATCH_SIZE)]
+            results = []
+            running = set()
+            for batch in batches:
+                if len(running) >= DRIVE_BATCH_CONCURRENCY:
+                    done, running = wait(running, return_when=FIRST_COMPLETED)
+                    results.extend(future.result() for future in done)
+                running.add(drive_pool.submit(self._trash_batch, batch))
+            results.extend(future.result() for future in wait(running)[0])
+
+            pending = {}
+            for done, retry, failed in results:
+                trashed.extend(done)
+                errors.update(failed)
+                pending.update(retry)
+
+        # Retries ran out
+        errors.update(pending)
+        return trashed, errors
+
+    def _trash_batch(self, file_ids):
+        """Sends one batch request. Returns (trashed_ids, {id: error} to retry, {id: error} failed)."""
+        service = self.get_service()
+        done, retry, failed = [], {}, {}
+
+        def callback(request_id, response, exception):
+            if exception is None:
+                done.append(request_id)
+            elif self._is_retryable(exception):
+                retry[request_id] = str(exception)
+            else:
+                print(f"🔴 Delete (trash) error for {request_id}: {exception}")
+                failed[request_id] = str(exception)
+
+        batch = service.new_batch_http_request(callback=callback)
+        for file_id in file_ids:
+            batch.add(
+                service.files().update(fileId=file_id, body={'trashed': True}, fields='id', supportsAllDrives=True),
+                request_id=file_id
+            )
+        try:
+            batch.execute()
+        except Exception as e:
+            # The batch itself failed (network, auth refresh); retry whatever got no answer
+            print(f"Batch trash error: {e}")
+            answered = set(done) | set(retry) | set(failed)
+            retry.update({fid: str(e) for fid in file_ids if fid not in answered})
+        return done, retry, failed
+
+    @staticmethod
+    def _is_retryable(exception):
+        status = getattr(getattr(exception, 'resp', None), 'status', None)
+        if status in (429, 500, 502, 503, 504):
+            return True
+        return status == 403 and 'ratelimitexceeded' in str(exception).lower()
+
+    def get_all_files(self, folders=None):
+        """Fetches all files in the configured folder and its subfolders.
+
+        If a `folders` dict is given it is filled with {folder_id: folder} for every
+        subfolder found. Returns [] if any part of the listing fails.
+        """
         service = self.get_service()
         if not service:
             return []
 
         from config import FOLDER_ID
-        
-        q = f"mimeType != 'application/vnd.google-apps.folder' and trashed = false"
+
         if FOLDER_ID:
-            q += f" and '{FOLDER_ID}' in parents"
-            
+            all_files = []
+            found = {}
+            try:
+                for _, children in self.walk_tree(FOLDER_ID):
+                    for f in children:
+                        if f.get('mimeType') == FOLDER_MIME:
+                            found[f['id']] = f
+                        else:
+                            all_files.append(f)
+            except Exception as e:
+                print(f"Get all files error: {e}")
+                return []
+            if folders is not None:
+                folders.update(found)
+            return all_files
+
+        q = f"mimeType != '{FOLDER_MIME}' and trashed = false"
         all_files = []
         page_token = None
         
@@ -209,7 +470,7 @@ class GoogleDriveHandler:
                 results = service.files().list(
                     q=q,
                     pageSize=1000,
-                    fields="nextPageToken, files(id, name, size, createdTime)",
+                    fields="nextPageToken, files(id, name, size, mimeType, parents, md5Checksum, createdTime, modifiedTime)",
                     pageToken=page_token,
                     supportsAllDrives=True,
                     includeItemsFromAllDrives=True
@@ -224,60 +485,103 @@ class GoogleDriveHandler:
             print(f"Get all files error: {e}")
             return []
 
-    def get_recursive_file_count(self, folder_id):
-        """Recursively count all files in a folder and its subfolders."""
+    def get_start_page_token(self):
+        """Returns the Drive changes token marking 'now', or None if unavailable."""
         service = self.get_service()
         if not service:
-            return 0
-        
-        total_count = 0
-        folders_to_scan = [folder_id]
-        
+            return None
+
         try:
-            while folders_to_scan:
-                current_folder = folders_to_scan.pop(0)
-                
-                # Count files in current folder
-                q_files = f"'{current_folder}' in parents and mimeType != 'application/vnd.google-apps.folder' and trashed = false"
-                page_token = None
-                while True:
-                    results = service.files().list(
-                        q=q_files,
-                        pageSize=1000,
-                        fields="nextPageToken, files(id)",
-                        pageToken=page_token,
-                        supportsAllDrives=True,
-                        includeItemsFromAllDrives=True
-                    ).execute()
-                    
-                    total_count += len(results.get('files', []))
-                    page_token = results.get('nextPageToken')
-                    if not page_token:
-                        break
-                
-                # Find subfolders
-                q_folders = f"'{current_folder}' in parents and mimeType = 'application/vnd.google-apps.folder' and trashed = false"
-                page_token = None
-                while True:
-                    results = service.files().list(
-                        q=q_folders,
-                        pageSize=1000,
-                        fields="nextPageToken, files(id)",
-                        pageToken=page_token,
-                        supportsAllDrives=True,
-                        includeItemsFromAllDrives=True
-                    ).execute()
-                    
-                    for f in results.get('files', []):
-                        folders_to_scan.append(f['id'])
-                    
-                    page_token = results.get('nextPageToken')
-                    if not page_token:
-                        break
-                        
-            return total_count
+            response = service.changes().getStartPageToken(supportsAllDrives=True).execute()
+            return response.get('startPageToken')
         except Exception as e:
-            print(f"Recursive count error: {e}")
-            return total_count # Return what we have so far
+            print(f"Start page token error: {e}")
+            return None
+
+    def get_changes(self, page_token):
+        """Fetches every change since page_token.
+
+        Returns (changes, next_token). If a page fails, the changes fetched so far are returned
+        with the token of the failed page so the next call resumes from there.
+        """
+        service = self.get_service()
+        if not service:
+            return [], page_token
+
+        all_changes = []
+        try:
+            while True:
+                results = service.changes().list(
+                    pageToken=page_token,
+                    pageSize=1000,
+                    includeRemoved=True,
+                    fields="nextPageToken, newStartPageToken, changes(fileId, removed, file(id, name, size, mimeType, parents, trashed, md5Checksum, createdTime, modifiedTime))",
+                    supportsAllDrives=True,
+                    includeItemsFromAllDrives=True
+                ).execute()
+
+                all_changes.extend(results.get('changes', []))
+                if 'newStartPageToken' in results:
+                    return all_changes, results['newStartPageToken']
+                page_token = results.get('nextPageToken')
+        except Exception as e:
+            print(f"Get changes error: {e}")
+            return all_changes, page_token
+
+    def list_children(self, folder_id, fields="id, name, size, mimeType, parents, md5Checksum, createdTime, modifiedTime"):
+        """Lists everything directly inside a folder, files and subfolders, with one paginated query."""
+        service = self.get_service()
+        if not service:
+            raise Exception("Drive service not initialized")
+
+        q = f"'{folder_id}' in parents and trashed = false"
+        children = []
+        page_token = None
+        while True:
+            results = service.files().list(
+                q=q,
+                pageSize=1000,
+                fields=f"nextPageToken, files({fields})",
+                pageToken=page_token,
+                supportsAllDrives=True,
+                includeItemsFromAllDrives=True
+            ).execute()
+
+            children.extend(results.get('files', []))
+            page_token = results.get('nextPageToken')
+            if not page_token:
+                return children
+
+    def walk_tree(self, folder_id, fields="id, name, size, mimeType, parents, md5Checksum, createdTime, modifiedTime"):
+        """Yields (folder_id, children) for folder_id and every folder below it.
+
+        Up to DRIVE_CRAWL_CONCURRENCY folders are listed at once on drive_pool threads,
+        and folders are yielded as their listings arrive rather than in tree order.
+        `fields` must include id and mimeType. Raises if a folder cannot be listed.
+        """
+        pending = deque([folder_id])
+        seen = {folder_id}
+        running = {} # {future: folder_id}
+        try:
+            while pending or running:
+                while pending and len(running) < DRIVE_CRAWL_CONCURRENCY:
+                    current = pending.popleft()
+                    running[drive_pool.submit(self.list_children, current, fields)] = current
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    current = running.pop(future)
+                    children = future.result()
+                    for child in children:
+                        # Drive allows a folder in several parents; visit it once
+                        if child.get('mimeType') == FOLDER_MIME and child['id'] not in seen:
+                            seen.add(child['id'])
+                            pending.append(child['id'])
+                    yield current, children
+        finally:
+            # Stopped early or failed: don't run listings nobody will read
+            for future in running:
+                future.cancel()
 
 drive_handler = GoogleDriveHandler()
+adrive = AsyncProxy(drive_handler)
@@ -0,0 +1,98 @@
+# group_search.py
+import asyncio
+import logging
+import re
+import time
+from collections import deque
+
+from config import GROUP_SEARCH_DEBOUNCE, GROUP_SEARCH_BUDGET
+
+logger = logging.getLogger(__name__)
+
+# Messages made only of these words are chat, not titles
+CHAT_WORDS = {
+    "hi", "hii", "hello", "hey", "ok", "okay", "ok.", "thanks", "thank", "thx", "tnx", "ty",
+    "yes", "no", "yeah", "nope", "lol", "hmm", "hm", "bro", "sis", "gm", "gn", "good",
+    "morning", "night", "welcome", "please", "pls", "plz", "admin", "bot", "wow", "nice",
+    "machan", "mchn", "ela", "ane", "aiyo", "hari", "ow", "na", "ne", "kohomada", "elakiri",
+}
+URL_OR_MENTION = re.compile(r"https?://|t\.me/|www\.|@\w+")
+
+def looks_conversational(text):
+    """Heuristic filter for group chatter that should not trigger an auto-search."""
+    words = text.lower().split()
+    if not words or len(words) > 8:
+        return True
+    if URL_OR_MENTION.search(text):
+        return True
+    if not any(c.isalpha() for c in text):
+        return True # Emoji, numbers, punctuation
+    if text.rstrip().endswith("?") and len(words) > 3:
+        return True
+    return all(word.strip("!.,?") in CHAT_WORDS for word in words)
+
+class GroupSearchScheduler:
+    """Rate-aware scheduling of group auto-searches.
+
+    - Debounce: a user's burst of messages in a chat results in one search, for the last message.
+    - Budget: each chat gets at most `budget` searches per `window` seconds; the rest are dropped.
+    - Repeats: a query already answered in the chat within the window is not answered again.
+    - Coalescing: identical queries running at the same time, from any chat, share one search.
+    """
+
+    def __init__(self, debounce=GROUP_SEARCH_DEBOUNCE, budget=GROUP_SEARCH_BUDGET, window=60):
+        self.debounce = debounce
+        self.budget = budget
+        self.window = window
+        self.pending = {} # {(chat_id, user_id): asyncio.Task}
+        self.history = {} # {chat_id: deque of (time, query)}
+        self.inflight = {} # {query: asyncio.Task}
+        self.dropped = 0
+
+    def schedule(self, chat_id, user_id, query, search, respond):
+        """Queues a search. `search(query)` and `respond(files)` are coroutine functions."""
+        key = (chat_id, user_id)
+        previous = self.pending.get(key)
+        if previous:
+            previous.cancel()
+        self.pending[key] = asyncio.create_task(self._run(key, chat_id, query, search, respond))
+
+    async def _run(self, key, chat_id, query, search, respond):
+        try:
+            await asyncio.sleep(self.debounce)
+        except asyncio.CancelledError:
+            return # Superseded by a newer message from the same user
+        if self.pending.get(key) is asyncio.current_task():
+            del self.pending[key]
+
+        query = " ".join(query.lower().split())
+        if not self._take_budget(chat_id, query):
+            self.dropped += 1
+            return
+
+        try:
+            files = await self._search_once(query, search)
+            await respond(files)
+        except Exception as e:
+            logger.error(f"Group auto-search error in {chat_id}: {e}")
+
+    def _take_budget(self, chat_id, query):
+        now = time.monotonic()
+        history = self.history.setdefault(chat_id, deque())
+        while history and now - history[0][0] > self.window:
+            history.popleft()
+        if len(history) >= self.budget or any(q == query for _, q in history):
+            return False
+        history.append((now, query))
+        return True
+
+    async def _search_once(self, query, search):
+        task = self.inflight.get(query)
+        if task is None:
+            task = asyncio.ensure_future(search(query))
+            self.inflight[query] = task
+            task.add_done_callback(lambda _: self.inflight.pop(query, None))
+        # Shielded so one waiter being cancelled doesn't cancel the search for the others
+        return await asyncio.shield(task)
+
+group_search = GroupSearchScheduler()
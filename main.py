@@ -2,6 +2,8 @@ import asyncio
 import logging
 import os
 import shutil
+import time
+from datetime import datetime
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -21,10 +23,15 @@ from pyrogram.types import (
     InputTextMessageContent
 )
 from pyrogram.enums import ChatMemberStatus
-from pyrogram.errors import UserNotParticipant, FloodWait
-from config import API_ID, API_HASH, BOT_TOKEN, ADMIN_USERNAMES, ADMIN_IDS, CHANNEL_USERNAME, CHANNEL_LINK, REQUEST_GROUP, DB_NAME
-from gdrive_handler import drive_handler
-from database import db
+from pyrogram.errors import UserNotParticipant
+from config import API_ID, API_HASH, BOT_TOKEN, ADMIN_USERNAMES, ADMIN_IDS, CHANNEL_USERNAME, CHANNEL_LINK, REQUEST_GROUP, DB_NAME, INDEX_SYNC_INTERVAL, USER_FLUSH_INTERVAL, SEARCH_FLUSH_INTERVAL, BAN_CACHE_TTL, INLINE_CACHE_TIME, DRIVE_BATCH_SIZE, DRIVE_BATCH_CONCURRENCY, AUTH_REFRESH_INTERVAL
+from gdrive_handler import drive_handler, adrive, FOLDER_MIME
+from database import db, adb
+from catalog import catalog, acatalog
+from executor import run_every, iterate_blocking
+from group_search import group_search, looks_conversational
+from broadcast import broadcaster
+from duplicates import find_duplicates, reclaimable_bytes
 
 # Global state
 broadcast_queues = {} # {user_id: [messages]}
@@ -32,6 +39,7 @@ admin_mode = {} # {user_id: bool}
 request_mode = {} # {user_id: bool}
 delete_mode = {} # {user_id: bool}
 duplicate_store = {} # {user_id: [file_ids]}
+recount_task = None # Background /recount, at most one at a time
 ban_mode = {} # {user_id: bool}
 unban_mode = {} # {user_id: bool}
 
@@ -102,13 +110,6 @@ def get_size_str(size_bytes):
     except Exception:
         return "Error"
 
-def get_progress_bar(current, total):
-    if total == 0: return "[░░░░░░░░░░] 0%"
-    percentage = (current / total) * 100
-    filled = int(percentage / 10)
-    bar = "█" * filled + "░" * (10 - filled)
-    return f"[{bar}] {percentage:.1f}%"
-
 async def safe_edit(message: Message, text, **kwargs):
     """Edit a message but ignore MESSAGE_NOT_MODIFIED errors."""
     try:
@@ -141,7 +142,8 @@ async def start_command(client, message):
     db.add_user(
         message.from_user.id, 
         message.from_user.first_name, 
-        message.from_user.username
+        message.from_user.username,
+        private=True
     )
 
     # Handle Deep Links (for Inline Downloads)
@@ -151,9 +153,9 @@ async def start_command(client, message):
             file_id = param.split("_", 1)[1]
             return await handle_download(client, message, file_id)
 
-    if not drive_handler.is_authenticated():
+    if not await adrive.is_authenticated():
         if is_admin(message.from_user):
-            auth_url = drive_handler.get_auth_url()
+            auth_url = await adrive.get_auth_url()
             if not auth_url:
                 await message.reply_text(
                     "❌ **Error:** `credentials.json` file not found.\n"
@@ -200,14 +202,18 @@ async def stats_command(client, message):
 
     msg = await message.reply_text("📊 **Generating Statistics...**")
     
-    total_users = db.get_user_count()
-    monthly_users = db.get_monthly_user_count()
-    total_chats, groups, channels = db.get_chat_stats()
-    total_searches = db.get_total_searches()
+    total_users = await adb.get_user_count()
+    monthly_users = await adb.get_monthly_user_count()
+    total_chats, groups, channels = await adb.get_chat_stats()
+    total_searches = await adb.get_total_searches()
+    searches_today = await adb.get_searches_since(0)
+    top_searches = await adb.get_top_searches(7, 5)
+    unreachable = await adb.get_unreachable_count()
     
-    # Deep Scan for accurate file count
-    from config import FOLDER_ID
-    file_count = drive_handler.get_recursive_file_count(FOLDER_ID)
+    # Served from the catalog; /recount walks the whole Drive tree on demand
+    file_count = catalog.count()
+    deep_count = await adb.get_setting("deep_file_count")
+    deep_count_at = await adb.get_setting("deep_file_count_at")
     
     stats_text = (
         "📊 **Bot Statistics**\n\n"
@@ -215,10 +221,20 @@ async def stats_command(client, message):
         f"📅 **Monthly Active Users:** `{monthly_users}`\n\n"
         f"📢 **Channels Added:** `{channels}`\n"
         f"👥 **Groups Added:** `{groups}`\n"
-        f"🏢 **Total Chats:** `{total_chats}`\n\n"
+        f"🏢 **Total Chats:** `{total_chats}`\n"
+        f"🚫 **Unreachable (skipped by broadcasts):** `{unreachable}`\n\n"
         f"🔍 **Total Searches:** `{total_searches}`\n"
+        f"📆 **Searches Today:** `{searches_today}`\n"
         f"📂 **Indexed Files:** `{file_count}`\n"
+        f"🌳 **Deep Count (all subfolders):** `{deep_count or 'never run, use /recount'}`"
+        f"{f' (as of {deep_count_at} UTC)' if deep_count else ''}\n"
+        f"⚡ **Search Cache:** `{catalog.cache.hits}` hits / `{catalog.cache.misses}` misses\n"
     )
+
+    if top_searches:
+        stats_text += "\n🔥 **Top Searches (7 days):**\n"
+        for term, count in top_searches:
+            stats_text += f"• `{term}`: {count}\n"
     
     await msg.edit(stats_text)
 
@@ -231,7 +247,7 @@ async def groups_command(client, message):
     msg = await message.reply_text("📋 **Fetching Group Details...**")
     
     try:
-        chats = db.get_all_chats_detailed()
+        chats = await adb.get_all_chats_detailed()
         if not chats:
             await msg.edit("❌ **No groups found in database.**")
             return
@@ -273,7 +289,7 @@ async def on_added_to_chat(client, chat_member_updated):
             if chat_member_updated.from_user.username:
                 adder_name += f" (@{chat_member_updated.from_user.username})"
 
-        db.add_chat(chat.id, chat.title, chat.username, chat_type, adder_id, adder_name)
+        await adb.add_chat(chat.id, chat.title, chat.username, chat_type, adder_id, adder_name)
         logger.info(f"Bot added to {chat_type}: {chat.title} ({chat.id}) by {adder_name or 'unknown'}")
 
 @app.on_message(filters.command("menu") & filters.private)
@@ -309,6 +325,7 @@ async def menu_command(client, message):
             "• `/del` - Search & Delete a file\n"
             "• `/scan` - Find duplicates\n"
             "• `/removeall` - Cleanup duplicates\n"
+            "• `/recount` - Recount all Drive files\n"
             "• `/ban` - Ban a user\n"
             "• `/unban` - Unban a user\n"
             "• `/groups` - View group details"
@@ -375,95 +392,22 @@ async def broadcast_now(client, message):
     if not db.is_postgres:
         db_type += f" ({os.path.abspath(DB_NAME)})"
 
-    users = db.get_all_users()
-    chats = db.get_all_chats()
-    
-    # Combined list for broadcasting
-    targets = list(set(users + chats))
-    total = len(targets)
     queue = broadcast_queues[user_id]
-    
     status_msg = await message.reply_text(
-        f"🚀 **Broadcasting {len(queue)} messages to {total} targets...**\n"
+        f"🚀 **Broadcasting {len(queue)} messages...**\n"
         f"📂 **DB Source:** `{db_type}`"
     )
-    
-    success = 0
-    failed = 0
-    errors = {} # {error_name: count}
-    
-    # Semaphore to limit concurrency (Telegram rate limits)
-    semaphore = asyncio.Semaphore(10) # 10 parallel sends
-    
-    async def send_to_target(tgt_id):
-        nonlocal success, failed
-        async with semaphore:
-            try:
-                for m in queue:
-                    try:
-                        await m.copy(tgt_id)
-                    except FloodWait as e:
-                        await asyncio.sleep(e.value)
-                        await m.copy(tgt_id)
-                    except Exception as e:
-                        raise e
-                    await asyncio.sleep(0.1) # Small delay per message in queue
-                success += 1
-            except Exception as e:
-                err_name = type(e).__name__
-                if "PEER_ID_INVALID" in str(e): err_name = "Bot Blocked"
-                elif "USER_DEACTIVATED" in str(e): err_name = "Deleted Account"
-                
-                errors[err_name] = errors.get(err_name, 0) + 1
-                logger.error(f"Broadcast error for {tgt_id}: {e}")
-                failed += 1
-
-    last_update_time = asyncio.get_event_loop().time()
-    
-    # Process targets
-    tasks = []
-    for i, target_id in enumerate(targets):
-        tasks.append(asyncio.create_task(send_to_target(target_id)))
-        
-        # Check progress and update status message periodically
-        if (i + 1) % 5 == 0 or (i + 1 == total):
-            current_time = asyncio.get_event_loop().time()
-            if (current_time - last_update_time > 5) or (i + 1 == total):
-                completed = success + failed
-                progress = get_progress_bar(completed, total)
-                status_text = (
-                    f"🚀 **Powerful Broadcast in Progress...**\n\n"
-                    f"📊 **Progress:** {progress}\n"
-                    f"✨ **Successful:** `{success}`\n"
-                    f"❌ **Failed:** `{failed}`\n"
-                    f"🎯 **Total Targets:** `{total}`\n"
-                    f"📂 **DB:** `{db_type}`"
-                )
-                await safe_edit(status_msg, status_text)
-                last_update_time = current_time
 
-    # Wait for all tasks to complete
-    await asyncio.gather(*tasks)
-    
-    # Final cleanup
+    try:
+        # The job is saved to the database and keeps running (and resumes after restarts) in the background
+        job_id = await broadcaster.start(client, user_id, queue, status_msg)
+    except Exception as e:
+        logger.error(f"Broadcast start error: {e}")
+        await safe_edit(status_msg, f"❌ **Error:** Could not start broadcast.\n`{str(e)}`")
+        return
+
     broadcast_queues[user_id] = []
-    
-    # Format error report
-    err_report = ""
-    if errors:
-        err_report = "\n\n⚠️ **Failure Reasons:**\n"
-        for err, count in errors.items():
-            err_report += f"• `{err}`: {count}\n"
-
-    await status_msg.edit(
-        f"✅ **Broadcast Completed!**\n\n"
-        f"✨ **Successful:** `{success}`\n"
-        f"❌ **Failed:** `{failed}`\n"
-        f"👥 **Total Targets:** `{total}`\n"
-        f"📂 **Database Source:** `{db_type}`"
-        f"{err_report}\n"
-        "Broadcast mode deactivated and queue cleared."
-    )
+    logger.info(f"Broadcast job {job_id} started by {user_id}")
 
 @app.on_message(filters.command("request") & filters.private)
 async def request_command(client, message):
@@ -526,58 +470,40 @@ async def scan_duplicates(client, message, from_user=None):
     status_msg = await message.reply_text("🔎 **Scanning Google Drive for duplicates...**\nPlease wait, this may take a moment.")
     
     try:
-        files = drive_handler.get_all_files()
+        # Only changes since the last sync are fetched; the scan itself runs on the local index
+        await acatalog.sync()
+        files = await acatalog.all_files()
         if not files:
             await safe_edit(status_msg, "❌ **No files found to scan.**")
             return
 
-        # Group files by name
-        grouped = {}
-        for f in files:
-            name = f.get('name')
-            if name not in grouped:
-                grouped[name] = []
-            grouped[name].append(f)
-
-        duplicates = []
-        to_delete_ids = []
-        
-        for name, file_list in grouped.items():
-            if len(file_list) > 1:
-                # Sort by createdTime (oldest first)
-                file_list.sort(key=lambda x: x.get('createdTime', ''))
-                
-                # Keep the first one, delete the rest
-                keep = file_list[0]
-                rems = file_list[1:]
-                
-                duplicates.append({
-                    'name': name,
-                    'count': len(file_list),
-                    'keep_id': keep['id']
-                })
-                to_delete_ids.extend([f['id'] for f in rems])
-
+        duplicates = find_duplicates(files)
         if not duplicates:
             await safe_edit(status_msg, "✅ **Scan Complete:** No duplicate files found!")
             return
 
+        to_delete_ids = [f['id'] for d in duplicates for f in d['remove']]
+        content_groups = sum(1 for d in duplicates if d['match'] == 'content')
+
         # Store IDs for removal
         duplicate_store[user.id] = to_delete_ids
         
         report = f"📂 **Duplicate Scan Results**\n\n"
-        report += f"✨ **Total Duplicates Found:** `{len(duplicates)} names`\n"
-        report += f"🗑️ **Files to be removed:** `{len(to_delete_ids)}` items\n\n"
+        report += f"🔍 **Files Scanned:** `{len(files)}`\n"
+        report += f"✨ **Total Duplicates Found:** `{len(duplicates)} groups`\n"
+        report += f"🧬 **Identical Content:** `{content_groups}` | **Same Name & Size:** `{len(duplicates) - content_groups}`\n"
+        report += f"🗑️ **Files to be removed:** `{len(to_delete_ids)}` items\n"
+        report += f"💾 **Space Reclaimable:** `{get_size_str(reclaimable_bytes(duplicates))}`\n\n"
         
         # Show a few examples
         report += "**Example Duplicates:**\n"
         for d in duplicates[:10]:
-            report += f"• `{d['name']}` ({d['count']} copies)\n"
+            report += f"• `{d['keep'].get('name')}` ({len(d['remove']) + 1} copies)\n"
         
         if len(duplicates) > 10:
             report += f"\n... and `{len(duplicates)-10}` more."
 
-        report += "\n\n🚀 Use `/removeall` to permanently delete these duplicates (keeping one original of each)."
+        report += "\n\n🚀 Use `/removeall` to permanently delete these duplicates (keeping the oldest copy of each)."
         
         await safe_edit(status_msg, report)
 
@@ -588,6 +514,42 @@ async def scan_duplicates(client, message, from_user=None):
         except Exception:
             await message.reply_text(f"❌ **Scan Error:** `{str(e)}`")
 
+@app.on_message(filters.command("recount") & filters.private)
+async def recount_command(client, message):
+    global recount_task
+    if not is_admin(message.from_user):
+        await message.reply_text("❌ **Denied:** Only admins can use this command.")
+        return
+
+    if recount_task and not recount_task.done():
+        await message.reply_text("⏳ **A recount is already running.**")
+        return
+
+    status_msg = await message.reply_text("🌳 **Deep recount started...**\nCounting files in every subfolder.")
+    recount_task = asyncio.create_task(run_recount(status_msg))
+
+async def run_recount(status_msg):
+    """Walks the whole Drive tree in the background, reporting progress, and stores the total for /stats."""
+    from config import FOLDER_ID
+    folders = files = 0
+    reported_at = time.monotonic()
+    try:
+        # Folders stream in as the crawler lists them, several at a time
+        async for _, children in iterate_blocking(drive_handler.walk_tree(FOLDER_ID, fields="id, mimeType")):
+            folders += 1
+            files += sum(1 for c in children if c.get('mimeType') != FOLDER_MIME)
+            if time.monotonic() - reported_at > 5:
+                reported_at = time.monotonic()
+                await safe_edit(status_msg, f"🌳 **Deep recount in progress...**\n\n📁 **Folders scanned:** `{folders}`\n📄 **Files counted:** `{files}`")
+    except Exception as e:
+        logger.error(f"Recount error: {e}")
+        await safe_edit(status_msg, f"❌ **Recount failed** after `{files}` files.\n`{str(e)}`")
+        return
+
+    await adb.set_setting("deep_file_count", str(files))
+    await adb.set_setting("deep_file_count_at", datetime.utcnow().strftime('%Y-%m-%d %H:%M'))
+    await safe_edit(status_msg, f"✅ **Deep recount complete!**\n\n📁 **Folders:** `{folders}`\n📄 **Files:** `{files}`")
+
 @app.on_message(filters.command("removeall") & filters.private)
 async def remove_duplicates(client, message):
     if not is_admin(message.from_user):
@@ -607,24 +569,29 @@ async def remove_duplicates(client, message):
     success = 0
     failed = 0
     first_error = None
+    # Batch requests run in parallel inside trash_files; chunks only pace the progress updates
+    chunk_size = DRIVE_BATCH_SIZE * DRIVE_BATCH_CONCURRENCY
     
-    for i, file_id in enumerate(ids):
+    for start in range(0, count, chunk_size):
         try:
-            drive_handler.delete_file(file_id)
-            success += 1
-            if (i + 1) % 10 == 0:
-                await safe_edit(status_msg, f"🗑️ **Progress:** Deleting... (`{i+1}/{count}`)")
+            trashed, errors = await adrive.trash_files(ids[start:start + chunk_size])
         except Exception as e:
-            failed += 1
-            if not first_error:
-                # Capture a more descriptive error if possible
-                first_error = str(e)
-                if "403" in first_error:
-                    first_error = "403 Forbidden (Wait for owner/manager permission)"
-                elif "404" in first_error:
-                    first_error = "404 Not Found"
-        
-        await asyncio.sleep(0.1) # Small delay to avoid API rate limits
+            trashed, errors = [], {file_id: str(e) for file_id in ids[start:start + chunk_size]}
+
+        success += len(trashed)
+        failed += len(errors)
+        await acatalog.remove(trashed)
+        if errors and not first_error:
+            # Capture a more descriptive error if possible
+            first_error = next(iter(errors.values()))
+            if "403" in first_error:
+                first_error = "403 Forbidden (Wait for owner/manager permission)"
+            elif "404" in first_error:
+                first_error = "404 Not Found"
+
+        done = min(start + chunk_size, count)
+        if done < count:
+            await safe_edit(status_msg, f"🗑️ **Progress:** Deleting... (`{done}/{count}`)")
 
     # Clear store
     duplicate_store[user_id] = []
@@ -696,7 +663,7 @@ async def handle_message(client, message):
     text = message.text or ""
 
     # Register user in database (if not already done via /start)
-    db.add_user(user_id, message.from_user.first_name, message.from_user.username)
+    db.add_user(user_id, message.from_user.first_name, message.from_user.username, private=True)
 
     # Check if admin is in broadcast mode
     if admin_mode.get(user_id):
@@ -753,7 +720,7 @@ async def handle_message(client, message):
     if ban_mode.get(user_id):
         target = text.strip()
         ban_mode[user_id] = False
-        if db.set_ban_status(target, 1):
+        if await adb.set_ban_status(target, 1):
             await message.reply_text(f"🚫 **Successfully banned:** `{target}`")
         else:
             await message.reply_text(f"❌ **Error:** User `{target}` not found in database.")
@@ -763,7 +730,7 @@ async def handle_message(client, message):
     if unban_mode.get(user_id):
         target = text.strip()
         unban_mode[user_id] = False
-        if db.set_ban_status(target, 0):
+        if await adb.set_ban_status(target, 0):
             await message.reply_text(f"✅ **Successfully unbanned:** `{target}`")
         else:
             await message.reply_text(f"❌ **Error:** User `{target}` not found in database.")
@@ -772,11 +739,11 @@ async def handle_message(client, message):
     logger.info(f"Message from {user_id}: {text}")
 
     # Check if user is sending an auth code
-    if not drive_handler.is_authenticated():
+    if not await adrive.is_authenticated():
         if is_admin(message.from_user):
             if len(text) > 20: # Rough check for auth code
                 try:
-                    if drive_handler.authenticate(text):
+                    if await adrive.authenticate(text):
                         await message.reply_text("✅ **Success!** You are now authenticated. Send me a file name to search.")
                     else:
                         await message.reply_text("❌ **Failed!** Invalid code. Please try again.")
@@ -798,13 +765,14 @@ async def handle_message(client, message):
 
     await perform_search(client, message, query, in_group=False)
 
-async def perform_search(client, message, query, in_group=False, for_deletion=False, auto_search=False):
-    """Reusable search logic for private chats and groups."""
+async def perform_search(client, message, query, in_group=False, for_deletion=False, auto_search=False, files=None):
+    """Reusable search logic for private chats and groups. Pass `files` to reply with results already fetched."""
     try:
-        # Increment total searches
-        db.increment_search_count()
+        # Counted in memory, written out periodically
+        db.increment_search_count(query)
         
-        files = drive_handler.search_files(query)
+        if files is None:
+            files = await acatalog.search(query)
         if not files:
             if not auto_search:
                 await message.reply_text(f"❌ **No files found for:** `{query}`")
@@ -840,7 +808,8 @@ async def group_search_command(client, message):
     if db.is_user_banned(user_id):
         return
 
-    db.add_user(user_id, message.from_user.first_name, message.from_user.username)
+    private = message.chat.type == enums.ChatType.PRIVATE
+    db.add_user(user_id, message.from_user.first_name, message.from_user.username, private=private)
     
     if len(message.command) < 2:
         await message.reply_text("❌ **Please provide a search query!**\nExample: `/tv Breaking Bad`")
@@ -855,7 +824,7 @@ async def group_search_command(client, message):
     in_group = message.chat.type in [enums.ChatType.GROUP, enums.ChatType.SUPERGROUP, enums.ChatType.CHANNEL]
     await perform_search(client, message, query, in_group=in_group)
 
-@app.on_message(filters.group & filters.text & ~filters.command(["start", "help", "menu", "tv", "search", "filter", "stats", "status", "del", "scan", "removeall", "ban", "unban", "broadcast", "broadcastnow", "clear", "request", "contact"]))
+@app.on_message(filters.group & filters.text & ~filters.command(["start", "help", "menu", "tv", "search", "filter", "stats", "status", "del", "scan", "removeall", "recount", "ban", "unban", "broadcast", "broadcastnow", "clear", "request", "contact"]))
 async def group_auto_search(client, message):
     user_id = message.from_user.id
     if db.is_user_banned(user_id):
@@ -871,13 +840,22 @@ async def group_auto_search(client, message):
         return
 
     db.add_user(user_id, message.from_user.first_name, message.from_user.username)
+
+    # Replies to other members and plain chatter are conversation, not searches
+    replied = message.reply_to_message
+    if (replied and not (replied.from_user and replied.from_user.is_self)) or looks_conversational(query):
+        return
     
     # We do a silent force join check for auto-search in groups
     # If they are not joined, we just don't respond to keep group clean
     if not await check_join(client, user_id):
         return
 
-    await perform_search(client, message, query, in_group=True, auto_search=True)
+    async def respond(files):
+        await perform_search(client, message, query, in_group=True, auto_search=True, files=files)
+
+    # Debounced, deduplicated and budgeted per chat
+    group_search.schedule(message.chat.id, user_id, query, acatalog.search, respond)
 
 async def handle_download(client, message, file_id):
     """Core logic to download a file and send it to user."""
@@ -888,39 +866,77 @@ async def handle_download(client, message, file_id):
         return
 
     full_name = "file"
+
+    # Files already uploaded once are resent by their Telegram file_id, skipping Drive entirely
+    file_info = catalog.get(file_id)
+    if file_info and await send_cached_document(client, message.chat.id, file_id, file_info):
+        return
     
     # Show initial status
     msg = await message.reply_text("📥 **Fetching file info...**")
     
     try:
-        service = drive_handler.get_service()
-        if not service:
+        if not await adrive.is_authenticated():
             await msg.edit("❌ **Error:** Google Drive service not initialized.")
             return
 
-        file_info = service.files().get(fileId=file_id, fields="name", supportsAllDrives=True).execute()
+        if not file_info:
+            file_info = await adrive.get_file_info(file_id)
+            if await send_cached_document(client, message.chat.id, file_id, file_info):
+                await msg.delete()
+                return
         full_name = file_info.get('name', 'file')
         
         await msg.edit(f"📥 **Downloading:** `{full_name}`\nPlease wait...")
         
-        path = drive_handler.download_file(file_id, full_name)
-        await msg.edit(f"📤 **Uploading:** `{full_name}` to Telegram...")
-        
-        await client.send_document(
-            chat_id=message.chat.id,
-            document=path,
-            caption=f"✅ **File:** `{full_name}`"
-        )
+        # Streamed into memory (or a temp file for large files) and uploaded from there
+        buffer = await adrive.download_to_buffer(file_id, file_info.get('size'))
+        try:
+            await msg.edit(f"📤 **Uploading:** `{full_name}` to Telegram...")
+
+            sent = await client.send_document(
+                chat_id=message.chat.id,
+                document=buffer,
+                file_name=full_name,
+                caption=f"✅ **File:** `{full_name}`"
+            )
+        finally:
+            buffer.close()
         await msg.delete()
-        
-        # Cleanup
-        if os.path.exists(path):
-            os.remove(path)
+
+        if sent and sent.document:
+            await adb.cache_document(file_id, sent.document.file_id, file_info.get('md5Checksum'), file_info.get('modifiedTime'))
             
     except Exception as e:
         logger.error(f"Download error: {e}")
         await msg.edit(f"❌ **Error:** Failed to download or send file.\n`{str(e)}`")
 
+async def send_cached_document(client, chat_id, file_id, file_info):
+    """Resends a previously uploaded copy of the file. Returns False if there is no usable copy."""
+    cached = await adb.get_cached_document(file_id)
+    if not cached:
+        return False
+
+    tg_file_id, md5_checksum, modified_time = cached
+    # The Drive file changed since it was uploaded
+    if md5_checksum and file_info.get('md5Checksum'):
+        if md5_checksum != file_info.get('md5Checksum'):
+            return False
+    elif modified_time != file_info.get('modifiedTime'):
+        return False
+
+    try:
+        await client.send_document(
+            chat_id=chat_id,
+            document=tg_file_id,
+            caption=f"✅ **File:** `{file_info.get('name', 'file')}`"
+        )
+        return True
+    except Exception as e:
+        logger.warning(f"Cached document for {file_id} unusable, re-uploading: {e}")
+        await adb.delete_cached_document(file_id)
+        return False
+
 @app.on_inline_query()
 async def inline_search(client, inline_query):
     user_id = inline_query.from_user.id
@@ -943,7 +959,8 @@ async def inline_search(client, inline_query):
         return
 
     try:
-        files = drive_handler.search_files(query)
+        # Telegram rejects inline answers with more than 50 results
+        files = await acatalog.search(query, limit=50)
         results = []
         
         for file in files:
@@ -966,7 +983,7 @@ async def inline_search(client, inline_query):
                 )
             )
         
-        await inline_query.answer(results, cache_time=1)
+        await inline_query.answer(results, cache_time=INLINE_CACHE_TIME)
     except Exception as e:
         logger.error(f"Inline search error: {e}")
 
@@ -1006,13 +1023,13 @@ async def delete_callback(client, callback_query: CallbackQuery):
     
     # Optional: Get filename first for better feedback
     try:
-        service = drive_handler.get_service()
-        file_info = service.files().get(fileId=file_id, fields="name", supportsAllDrives=True).execute()
+        file_info = await adrive.get_file_info(file_id, fields="name")
         filename = file_info.get('name', 'Unknown')
         
         await callback_query.message.edit(f"🗑️ **Deleting:** `{filename}`...")
         
-        if drive_handler.delete_file(file_id):
+        if await adrive.delete_file(file_id):
+            await acatalog.remove([file_id])
             await callback_query.message.edit(f"✅ **Permanently Deleted:** `{filename}`")
         else:
             await callback_query.message.edit(f"❌ **Failed to delete:** `{filename}`")
@@ -1028,9 +1045,31 @@ if __name__ == "__main__":
         print("⚠️  WARNING: You are using a placeholder BOT_TOKEN in config.py!")
         print("Please replace it with your actual token from @BotFather.")
     
+    async def index_sync_loop():
+        """Keeps the local search index in step with Google Drive."""
+        while True:
+            try:
+                if await adrive.is_authenticated():
+                    await acatalog.sync()
+            except Exception as e:
+                logger.error(f"Index sync error: {e}")
+            await asyncio.sleep(INDEX_SYNC_INTERVAL)
+
     async def start_bot():
         await app.start()
         logger.info("Bot started!")
+
+        # Serve searches from the persisted index right away, then keep it synced
+        await acatalog.load()
+        asyncio.create_task(index_sync_loop())
+        asyncio.create_task(run_every(USER_FLUSH_INTERVAL, db.flush_users))
+        asyncio.create_task(run_every(SEARCH_FLUSH_INTERVAL, db.flush_search_counts))
+        asyncio.create_task(run_every(BAN_CACHE_TTL, db.refresh_bans))
+        # Renew the Drive token before it expires instead of on a user's request
+        asyncio.create_task(run_every(AUTH_REFRESH_INTERVAL, drive_handler.refresh_if_expiring))
+
+        # Pick up broadcasts interrupted by a restart
+        await broadcaster.resume_all(app)
         
         # Set command menu
         commands = [
@@ -1044,6 +1083,7 @@ if __name__ == "__main__":
             BotCommand("del", "Delete a file from GDrive (Admin)"),
             BotCommand("scan", "Scan for duplicates (Admin)"),
             BotCommand("removeall", "Remove all duplicates (Admin)"),
+            BotCommand("recount", "Recount files in all Drive folders (Admin)"),
             BotCommand("ban", "Ban a user (Admin)"),
             BotCommand("unban", "Unban a user (Admin)"),
         ]
@@ -1051,6 +1091,10 @@ if __name__ == "__main__":
         logger.info("Command menu registered!")
         
         await idle()
+
+        # Write out buffered user activity and search counts before exiting
+        await adb.flush_users()
+        await adb.flush_search_counts()
         await app.stop()
 
     try:
@@ -0,0 +1,71 @@
+# rate_limiter.py
+import asyncio
+import time
+
+from config import BROADCAST_MAX_RATE, BROADCAST_INITIAL_RATE
+
+class AdaptiveRateLimiter:
+    """Token bucket shared by all senders, with a per-chat spacing on top.
+
+    The global rate grows additively while sends succeed and is halved on every
+    FloodWait, which also pauses every sender until the wait is over (AIMD, like
+    TCP congestion control). This keeps broadcasts close to Telegram's ~30 msg/s
+    limit without cascading flood bans.
+    """
+
+    def __init__(self, max_rate=BROADCAST_MAX_RATE, initial_rate=BROADCAST_INITIAL_RATE,
+                 min_rate=1.0, per_chat_interval=1.0, increase_every=50, increase_by=1.0):
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.rate = min(initial_rate, max_rate)
+        self.per_chat_interval = per_chat_interval
+        self.increase_every = increase_every
+        self.increase_by = increase_by
+        self.tokens = 1.0
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.chat_next = {} # {chat_id: earliest time of the next send}
+        self.streak = 0
+        self.flood_waits = 0
+        self.lock = asyncio.Lock()
+
+    async def acquire(self, chat_id=None):
+        """Waits until a message may be sent (to chat_id, if given)."""
+        if chat_id is not None:
+            # Reserve this chat's next slot first, so messages to one chat stay spaced
+            now = time.monotonic()
+            slot = max(now, self.chat_next.get(chat_id, 0))
+            self.chat_next[chat_id] = slot + self.per_chat_interval
+            if slot > now:
+                await asyncio.sleep(slot - now)
+
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self.tokens = min(1.0, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def release(self, chat_id):
+        """Forgets a chat's spacing once nothing more will be sent to it."""
+        self.chat_next.pop(chat_id, None)
+
+    def on_success(self):
+        self.streak += 1
+        if self.streak >= self.increase_every:
+            self.streak = 0
+            self.rate = min(self.max_rate, self.rate + self.increase_by)
+
+    def on_flood_wait(self, seconds):
+        """Pauses every sender for `seconds` and halves the rate."""
+        self.flood_waits += 1
+        self.streak = 0
+        self.rate = max(self.min_rate, self.rate / 2)
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0.0
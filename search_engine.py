@@ -0,0 +1,241 @@
+# search_engine.py
+import heapq
+import math
+import re
+from collections import Counter
+
+# Separators between words in file names ("Breaking.Bad.S02E05.srt")
+TOKEN_SPLIT = re.compile(r"[\s.\-_,:;!?'\"`+&/\\|()\[\]{}<>#~*=]+")
+# s02e05, s2, e5, ep5, 2x05
+SEASON_EPISODE = re.compile(r"^s(\d{1,2})e(\d{1,3})$|^s(\d{1,2})$|^ep?(\d{1,3})$|^(\d{1,2})x(\d{1,3})$")
+VOWELS = set("aeiouy")
+# Extensions carry no meaning for search and would otherwise match every file
+EXTENSIONS = re.compile(r"\.(srt|ass|ssa|sub|vtt|txt|zip|rar|7z)$", re.IGNORECASE)
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+# Minimum trigram similarity for a misspelt word to count as a match
+FUZZY_THRESHOLD = 0.4
+# Vocabulary words a single query word may expand to
+MAX_EXPANSIONS = 20
+# Docs scored per query; only very unspecific queries ("the") reach it
+MAX_CANDIDATES = 5000
+
+def natural_key(name):
+    """Sort key that orders 'E2' before 'E10', like Drive's name_natural."""
+    return [int(part) if part.isdigit() else part for part in re.split(r'(\d+)', (name or '').lower())]
+
+def tokenize(text):
+    return [t for t in TOKEN_SPLIT.split(text.lower()) if t]
+
+def parse(text):
+    """Splits text into (words, season, episode), pulling out season/episode markers."""
+    words = []
+    season = episode = None
+    tokens = tokenize(text)
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        match = SEASON_EPISODE.match(token)
+        if match:
+            s1, e1, s2, e2, s3, e3 = match.groups()
+            if s1 or s2 or s3:
+                season = int(s1 or s2 or s3)
+            if e1 or e2 or e3:
+                episode = int(e1 or e2 or e3)
+        elif token in ("season", "episode") and i + 1 < len(tokens) and tokens[i + 1].isdigit():
+            if token == "season":
+                season = int(tokens[i + 1])
+            else:
+                episode = int(tokens[i + 1])
+            i += 1
+        else:
+            words.append(token)
+        i += 1
+    return words, season, episode
+
+def trigrams(word):
+    padded = f"$${word}$"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def skeleton(word):
+    """Consonant skeleton, so 'brkng' matches 'breaking' and 'sinhla' matches 'sinhala'."""
+    if len(word) < 3 or not word.isascii() or not word.isalpha():
+        return None
+    chars = [word[0]] + [c for c in word[1:] if c not in VOWELS]
+    # Collapse doubled letters ("bigg" -> "bg")
+    return "".join(c for i, c in enumerate(chars) if i == 0 or c != chars[i - 1])
+
+class SearchEngine:
+    """Ranked, typo-tolerant search over short titles such as file names.
+
+    Words of every title go into an inverted index. Query words are matched exactly,
+    by prefix, by consonant skeleton or by trigram similarity, and documents are
+    scored with BM25 weighted by how close the match was. Season/episode markers
+    (s02e05, s2, 2x05, "season 2") filter and boost results instead of being matched
+    as text.
+    """
+
+    def __init__(self):
+        self.docs = {} # {doc_id: (words, season, episode, sort key)}
+        self.postings = {} # {word: {doc_id}}
+        self.grams = {} # {trigram: {word}}
+        self.gram_counts = {} # {word: number of trigrams}
+        self.skeletons = {} # {skeleton: {word}}
+        self.total_length = 0
+
+    def __len__(self):
+        return len(self.docs)
+
+    def add(self, doc_id, text):
+        if doc_id in self.docs:
+            self.remove(doc_id)
+
+        words, season, episode = parse(EXTENSIONS.sub("", text))
+        self.docs[doc_id] = (words, season, episode, natural_key(text))
+        self.total_length += len(words)
+        for word in set(words):
+            if word not in self.postings:
+                self.postings[word] = set()
+                self._add_word(word)
+            self.postings[word].add(doc_id)
+
+    def remove(self, doc_id):
+        entry = self.docs.pop(doc_id, None)
+        if not entry:
+            return
+
+        words = entry[0]
+        self.total_length -= len(words)
+        for word in set(words):
+            docs = self.postings.get(word)
+            if docs is None:
+                continue
+            docs.discard(doc_id)
+            if not docs:
+                del self.postings[word]
+                self._remove_word(word)
+
+    def _add_word(self, word):
+        grams = trigrams(word)
+        self.gram_counts[word] = len(grams)
+        for gram in grams:
+            self.grams.setdefault(gram, set()).add(word)
+        skel = skeleton(word)
+        if skel:
+            self.skeletons.setdefault(skel, set()).add(word)
+
+    def _remove_word(self, word):
+        self.gram_counts.pop(word, None)
+        for gram in trigrams(word):
+            words = self.grams.get(gram)
+            if words is not None:
+                words.discard(word)
+                if not words:
+                    del self.grams[gram]
+        skel = skeleton(word)
+        if skel and skel in self.skeletons:
+            self.skeletons[skel].discard(word)
+            if not self.skeletons[skel]:
+                del self.skeletons[skel]
+
+    def expand(self, token):
+        """Returns {vocabulary word: similarity in (0, 1]} for words that may be `token`."""
+        matches = {}
+        if token in self.postings:
+            matches[token] = 1.0
+        # Numbers and single letters only match exactly
+        if token.isdigit() or len(token) < 2:
+            return matches
+
+        query_grams = trigrams(token)
+        overlaps = Counter()
+        for gram in query_grams:
+            for word in self.grams.get(gram, ()):
+                overlaps[word] += 1
+
+        for word, overlap in overlaps.items():
+            if word in matches:
+                continue
+            if word.startswith(token):
+                matches[word] = 0.6 + 0.3 * len(token) / len(word)
+                continue
+            dice = 2 * overlap / (len(query_grams) + self.gram_counts[word])
+            if dice >= FUZZY_THRESHOLD:
+                matches[word] = 0.8 * dice
+
+        skel = skeleton(token)
+        for word in self.skeletons.get(skel, ()) if skel else ():
+            if matches.get(word, 0) < 0.7:
+                matches[word] = 0.7
+
+        if len(matches) > MAX_EXPANSIONS:
+            matches = dict(sorted(matches.items(), key=lambda m: -m[1])[:MAX_EXPANSIONS])
+        return matches
+
+    def search(self, query, limit=100):
+        """Returns up to `limit` doc ids, best match first."""
+        words, season, episode = parse(query)
+        if not words or not self.docs:
+            return []
+
+        total_docs = len(self.docs)
+        avg_length = self.total_length / total_docs or 1
+        # Every word has to match (fuzzily); long queries may miss one
+        required = len(words) if len(words) < 3 else len(words) - 1
+
+        # Rarest words first: any qualifying doc must match one of the first
+        # (misses + 1) of them, which bounds the docs scored for common words
+        expansions = sorted(
+            (self.expand(token) for token in words),
+            key=lambda matches: sum(len(self.postings[word]) for word in matches)
+        )
+        seed_count = len(words) - required + 1
+        candidates = set()
+        for matches in expansions[:seed_count]:
+            # Closest words first, so the cap below drops the weakest matches
+            for word in sorted(matches, key=lambda w: -matches[w]):
+                candidates |= self.postings[word]
+                if len(candidates) >= MAX_CANDIDATES:
+                    break
+        if not candidates:
+            return []
+        if len(candidates) > MAX_CANDIDATES:
+            candidates = set(list(candidates)[:MAX_CANDIDATES])
+
+        scores = Counter()
+        coverage = Counter()
+        for matches in expansions:
+            best = {}
+            for word, similarity in matches.items():
+                docs = self.postings[word]
+                idf = math.log(1 + (total_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+                weight = similarity * idf * (K1 + 1)
+                for doc_id in (docs & candidates if len(docs) > len(candidates) else docs):
+                    if doc_id not in candidates:
+                        continue
+                    length = len(self.docs[doc_id][0])
+                    score = weight / (1 + K1 * (1 - B + B * length / avg_length))
+                    if score > best.get(doc_id, 0):
+                        best[doc_id] = score
+            for doc_id, score in best.items():
+                scores[doc_id] += score
+                coverage[doc_id] += 1
+
+        ranked = []
+        for doc_id, covered in coverage.items():
+            if covered < required:
+                continue
+            _, doc_season, doc_episode, sort_key = self.docs[doc_id]
+            if season is not None and doc_season is not None and doc_season != season:
+                continue
+            if episode is not None and doc_episode is not None and doc_episode != episode:
+                continue
+            bonus = (season is not None and doc_season == season) + (episode is not None and doc_episode == episode)
+            ranked.append((-covered, -bonus, -round(scores[doc_id], 6), doc_id))
+
+        # Ties (e.g. episodes of one series) keep natural name order
+        top = heapq.nsmallest(limit, ranked, key=lambda r: (r[0], r[1], r[2], self.docs[r[3]][3]))
+        return [r[3] for r in top]
@@ -0,0 +1,129 @@
+import os
+import tempfile
+
+# Keep the test index out of the bot's database, and root the tree at a known folder
+TEST_DB = os.path.join(tempfile.mkdtemp(), "test_catalog.db")
+os.environ["DB_NAME"] = TEST_DB
+os.environ.pop("DATABASE_URL", None)
+os.environ["FOLDER_ID"] = "root"
+
+import catalog as catalog_module
+import database
+from catalog import FileCatalog
+from gdrive_handler import drive_handler, FOLDER_MIME
+
+# config is read once per process: if another module loaded it first, the settings above came too late
+catalog_module.FOLDER_ID = "root"
+assert database.DB_NAME == TEST_DB and not database.db.is_postgres, "run test_catalog.py before anything opens the bot's database"
+
+def drive_file(file_id, name, parent="root", **extra):
+    return {'id': file_id, 'name': name, 'size': '100', 'mimeType': 'application/x-subrip', 'parents': [parent], **extra}
+
+def drive_folder(folder_id, parent="root", **extra):
+    return {'id': folder_id, 'name': folder_id, 'mimeType': FOLDER_MIME, 'parents': [parent], **extra}
+
+def change(f):
+    return {'fileId': f['id'], 'removed': False, 'file': f}
+
+def removed(file_id):
+    return {'fileId': file_id, 'removed': True}
+
+def new_catalog():
+    catalog = FileCatalog()
+    catalog.loaded = True
+    return catalog
+
+def test_add_rename_and_trash():
+    catalog = new_catalog()
+    assert catalog.apply_changes([
+        change(drive_file("a", "Loki.S01E01.srt")),
+        change(drive_file("b", "Loki.S01E02.srt")),
+    ]) == 2
+    assert set(catalog.files) == {"a", "b"}
+    assert catalog.count() == 2
+
+    catalog.apply_changes([change(drive_file("a", "Loki.S01E01.Sinhala.srt"))])
+    assert catalog.files["a"]["name"] == "Loki.S01E01.Sinhala.srt"
+    assert [f['id'] for f in catalog.search("sinhala")] == ["a"]
+
+    catalog.apply_changes([change(drive_file("b", "Loki.S01E02.srt", trashed=True))])
+    assert set(catalog.files) == {"a"}
+
+    catalog.apply_changes([removed("a")])
+    assert catalog.files == {}
+
+def test_file_moved_out_of_tree():
+    catalog = new_catalog()
+    catalog.apply_changes([change(drive_file("a", "Loki.S01E01.srt"))])
+    # Moved elsewhere, and a file created outside the tree
+    assert catalog.apply_changes([
+        change(drive_file("a", "Loki.S01E01.srt", parent="elsewhere")),
+        change(drive_file("b", "Loki.S01E02.srt", parent="elsewhere")),
+    ]) == 2
+    assert catalog.files == {}
+    assert catalog.folders == {}
+
+def test_folder_moved_in_lists_its_subtree():
+    catalog = new_catalog()
+    catalog.apply_changes([change(drive_file("a", "Loki.S01E01.srt"))])
+
+    def walk_tree(folder_id):
+        assert folder_id == "f1"
+        yield "f1", [drive_file("x", "Dark.S01E01.srt", parent="f1"), drive_folder("f2", parent="f1")]
+        yield "f2", [drive_file("y", "Dark.S02E01.srt", parent="f2")]
+
+    original = drive_handler.walk_tree
+    drive_handler.walk_tree = walk_tree
+    try:
+        # The file change sorts after its folder's, so it is judged against the new folder set
+        count = catalog.apply_changes([
+            change(drive_file("z", "Dark.S01E02.srt", parent="f1")),
+            change(drive_folder("f1")),
+        ])
+    finally:
+        drive_handler.walk_tree = original
+
+    assert count == 3
+    assert catalog.folders == {"f1": "root", "f2": "f1"}
+    assert set(catalog.files) == {"a", "x", "y", "z"}
+
+def test_folder_moved_out_prunes_subtree():
+    catalog = new_catalog()
+    catalog.folders = {"f1": "root", "f2": "f1", "f3": "root"}
+    catalog.add([
+        drive_file("a", "Loki.S01E01.srt"),
+        drive_file("x", "Dark.S01E01.srt", parent="f1"),
+        drive_file("y", "Dark.S02E01.srt", parent="f2"),
+        drive_file("w", "Lost.S01E01.srt", parent="f3"),
+    ])
+
+    assert catalog.apply_changes([change(drive_folder("f1", parent="elsewhere"))]) == 2
+    assert catalog.folders == {"f3": "root"}
+    assert set(catalog.files) == {"a", "w"}
+
+def test_folder_renamed_then_removed():
+    catalog = new_catalog()
+    catalog.folders = {"f1": "root", "f2": "f1"}
+    catalog.add([drive_file("y", "Dark.S02E01.srt", parent="f2")])
+
+    # Moved within the tree: tracked under its new parent, files untouched
+    assert catalog.apply_changes([change(drive_folder("f2", parent="root"))]) == 0
+    assert catalog.folders == {"f1": "root", "f2": "root"}
+    assert set(catalog.files) == {"y"}
+
+    # Deleted for good: removal records carry no file, only the id
+    assert catalog.apply_changes([removed("f2")]) == 1
+    assert catalog.folders == {"f1": "root"}
+    assert catalog.files == {}
+
+def test_search_limit():
+    catalog = new_catalog()
+    catalog.add([drive_file(str(i), f"Loki.S01E{i:02}.srt") for i in range(1, 61)])
+    # Inline answers take at most 50; a cached 50 must not cut short a later full search
+    assert len(catalog.search("loki", limit=50)) == 50
+    assert len(catalog.search("loki")) == 60
+
+if __name__ == "__main__":
+    for test in [test_add_rename_and_trash, test_file_moved_out_of_tree, test_folder_moved_in_lists_its_subtree, test_folder_moved_out_prunes_subtree, test_folder_renamed_then_removed, test_search_limit]:
+        test()
+        print(f"✅ {test.__name__}")
@@ -0,0 +1,59 @@
+from duplicates import find_duplicates, normalize_name, reclaimable_bytes
+
+def drive_file(file_id, name, md5=None, size=100, created="2024-01-01T00:00:00Z"):
+    return {'id': file_id, 'name': name, 'md5Checksum': md5, 'size': str(size), 'createdTime': created}
+
+def test_normalize_name():
+    assert normalize_name("Copy of Loki.S01E02.srt") == "loki s01e02 srt"
+    assert normalize_name("Loki_S01E02 (1).srt") == "loki s01e02 srt"
+    assert normalize_name("Loki.S01E02 - Copy.srt") == "loki s01e02 srt"
+
+def test_groups_by_content_hash():
+    files = [
+        drive_file("b", "Loki.S01E02.srt", md5="aaa", created="2024-02-01T00:00:00Z"),
+        drive_file("a", "loki s01e02 (sinhala).srt", md5="aaa", created="2024-01-01T00:00:00Z"),
+        # Same name, different content: not a duplicate
+        drive_file("c", "Loki.S01E02.srt", md5="bbb"),
+    ]
+    groups = find_duplicates(files)
+    assert len(groups) == 1
+    assert groups[0]['keep']['id'] == "a"
+    assert [f['id'] for f in groups[0]['remove']] == ["b"]
+    assert groups[0]['match'] == "content"
+
+def test_name_and_size_fallback():
+    files = [
+        drive_file("a", "Loki.S01E02.srt", size=300),
+        drive_file("b", "Copy of Loki.S01E02.srt", size=300, created="2024-03-01T00:00:00Z"),
+        drive_file("c", "Loki.S01E02.srt", size=200),
+    ]
+    groups = find_duplicates(files)
+    assert [(g['keep']['id'], [f['id'] for f in g['remove']], g['match']) for g in groups] == [("a", ["b"], "name")]
+    assert reclaimable_bytes(groups) == 300
+
+def test_empty_files_are_not_duplicates():
+    empty = "d41d8cd98f00b204e9800998ecf8427e"
+    files = [drive_file("a", "a.srt", md5=empty, size=0), drive_file("b", "b.srt", md5=empty, size=0)]
+    assert find_duplicates(files) == []
+
+def test_different_hashes_are_never_grouped():
+    files = [
+        drive_file("a", "Loki.S01E02.srt", md5="aaa", size=300),
+        # A corrected re-upload: same name and size, different content
+        drive_file("b", "Loki S01E02 (1).srt", md5="bbb", size=300, created="2024-03-01T00:00:00Z"),
+    ]
+    assert find_duplicates(files) == []
+
+    # An unhashed copy still matches a lone hashed file by name
+    files = [drive_file("a", "Loki.S01E02.srt", md5="aaa", size=300), drive_file("c", "Loki.S01E02.srt", size=300, created="2024-03-01T00:00:00Z")]
+    groups = find_duplicates(files)
+    assert [(g['keep']['id'], [f['id'] for f in g['remove']], g['match']) for g in groups] == [("a", ["c"], "name")]
+
+    # ...but not when the name is shared by two different contents
+    files.append(drive_file("b", "Loki.S01E02.srt", md5="bbb", size=300))
+    assert find_duplicates(files) == []
+
+if __name__ == "__main__":
+    for test in [test_normalize_name, test_groups_by_content_hash, test_name_and_size_fallback, test_empty_files_are_not_duplicates, test_different_hashes_are_never_grouped]:
+        test()
+        print(f"✅ {test.__name__}")
@@ -0,0 +1,51 @@
+from search_engine import SearchEngine, parse
+
+def build_engine():
+    engine = SearchEngine()
+    names = [
+        "Breaking.Bad.S01E01.srt",
+        "Breaking.Bad.S02E01.srt",
+        "Breaking.Bad.S02E05.srt",
+        "Better.Call.Saul.S01E01.srt",
+        "Loki.S01E02.srt",
+        "Loki.S01E10.srt",
+        "The.Boys.S03E01.srt",
+    ]
+    for i, name in enumerate(names):
+        engine.add(str(i), name)
+    return engine, names
+
+def test_parse_season_episode():
+    assert parse("Breaking.Bad.S02E05.srt") == (["breaking", "bad", "srt"], 2, 5)
+    assert parse("Breaking.Bad.S02E05") == (["breaking", "bad"], 2, 5)
+    assert parse("the boys season 3") == (["the", "boys"], 3, None)
+    assert parse("loki 1x10") == (["loki"], 1, 10)
+
+def test_exact_and_natural_order():
+    engine, names = build_engine()
+    results = [names[int(i)] for i in engine.search("loki")]
+    assert results == ["Loki.S01E02.srt", "Loki.S01E10.srt"]
+
+def test_typos_and_abbreviations():
+    engine, names = build_engine()
+    assert names[int(engine.search("brkng bad")[0])].startswith("Breaking.Bad")
+    assert names[int(engine.search("braking bad")[0])].startswith("Breaking.Bad")
+    assert names[int(engine.search("bett")[0])] == "Better.Call.Saul.S01E01.srt"
+
+def test_season_filter():
+    engine, names = build_engine()
+    results = [names[int(i)] for i in engine.search("brkng bad s2")]
+    assert results == ["Breaking.Bad.S02E01.srt", "Breaking.Bad.S02E05.srt"]
+    assert [names[int(i)] for i in engine.search("breaking bad s02e05")] == ["Breaking.Bad.S02E05.srt"]
+
+def test_remove():
+    engine, names = build_engine()
+    engine.remove("4")
+    assert [names[int(i)] for i in engine.search("loki")] == ["Loki.S01E10.srt"]
+    assert engine.search("the boys") == ["6"]
+    assert engine.search("nothing matches this") == []
+
+if __name__ == "__main__":
+    for test in [test_parse_season_episode, test_exact_and_natural_order, test_typos_and_abbreviations, test_season_filter, test_remove]:
+        test()
+        print(f"✅ {test.__name__}")